@@ -4,12 +4,11 @@
 # To check if there is NaN in the orbits, or if the simulation did not have time to finish itself before the allowed time by the server.
 
 import os
-import pdb
-import autiwa
-import sys
-import subprocess
+import argparse
+import concurrent.futures
+import itertools
+import json
 import simulations_utilities
-import mercury_utilities
 
 # Get current working directory
 rep_exec = os.getcwd()
@@ -20,6 +19,115 @@ hostname = simulations_utilities.getHostname()
 scriptFolder = os.path.dirname(os.path.realpath(__file__)) # the folder in which the module is. 
 binaryPath = os.path.join(scriptFolder, os.path.pardir)
 
+TAIL_SIZE = 8192 # Number of bytes at the end of 'info.out' where we look for the end of integration message
+NB_WORKERS = min(32, (os.cpu_count() or 1) * 4) # Number of threads used to read the simulation files in parallel
+CACHE_FILENAME = ".mercury_check_cache.json" # File, in each meta folder, that store the status of the simulations from the previous run
+
+def has_NaN(filename):
+  """Return True if the string 'NaN' is present in the file 'filename'. 
+  If the file does not exist, we consider there is no NaN in it"""
+  try:
+    dump_file = open(filename, 'rb')
+  except IOError:
+    return False
+  content = dump_file.read()
+  dump_file.close()
+  
+  return (b'NaN' in content)
+
+def is_finished(filename):
+  """Return True if 'Integration complete' is present in the last 
+  TAIL_SIZE bytes of the file 'filename' (typically 'info.out'). Only 
+  the end of the file is read, whatever its size. 
+  If the file does not exist, False is returned"""
+  try:
+    info_file = open(filename, 'rb')
+  except IOError:
+    return False
+  size = os.fstat(info_file.fileno()).st_size
+  info_file.seek(max(0, size - TAIL_SIZE))
+  tail = info_file.read()
+  info_file.close()
+  
+  return (b'Integration complete' in tail)
+
+def get_signature(simu_path):
+  """Return a tuple (mtime, size, mtime, size) for the files 'big.dmp' and 'info.out' 
+  of the simulation stored in 'simu_path'. If they did not change, neither did the status of 
+  the simulation. (None, None) is used for a file that does not exist"""
+  signature = ()
+  for filename in ["big.dmp", "info.out"]:
+    try:
+      stat = os.stat(os.path.join(simu_path, filename))
+      signature += (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+      signature += (None, None)
+  
+  return signature
+
+def read_cache(meta_path):
+  """Return the dictionnary {simu: (signature, status)} stored in the 
+  cache file of the folder 'meta_path', or an empty dictionnary if it does not exist or is not readable. 
+  The cache is stored in JSON (and not pickle) because anyone that can write in the folder could 
+  otherwise run code through it"""
+  try:
+    cache_file = open(os.path.join(meta_path, CACHE_FILENAME), 'r')
+  except IOError:
+    return {}
+  # Whatever the problem with the content of the file, the cache is simply ignored
+  try:
+    # JSON only has lists, signatures are converted back to tuples to be compared with get_signature()
+    cache = {simu: (tuple(signature), status) for (simu, (signature, status)) in json.load(cache_file).items()}
+  except Exception:
+    cache = {}
+  cache_file.close()
+  
+  return cache
+
+def write_cache(meta_path, cache):
+  """Store the dictionnary 'cache' in the cache file of the folder 'meta_path'. 
+  The file is written under a temporary name then renamed, so that an interrupted 
+  run can't leave a corrupted cache. If the folder can't be written (archived simulations 
+  for instance), the cache is simply not stored"""
+  cache_path = os.path.join(meta_path, CACHE_FILENAME)
+  
+  try:
+    with open(cache_path + ".tmp", 'w') as cache_file:
+      json.dump(cache, cache_file)
+    os.replace(cache_path + ".tmp", cache_path)
+  except OSError:
+    pass
+
+def classify(simu_path, cache):
+  """Return a tuple (status, signature) for the simulation stored in the folder 'simu_path'. 
+  'status' is :
+  None if the folder is not a simulation folder ('param.in' does not exist)
+  0 if the simulation ended correctly
+  1 if the simulation did not have time to finish
+  2 if NaN are present
+  'signature' is the one given by get_signature(). If it's the same as the one stored 
+  in the dictionnary 'cache' (see read_cache()), the stored status is returned without reading the files.
+  
+  The function only read files, and can thus be run in parallel for several simulations"""
+  if not(os.path.isfile(os.path.join(simu_path, "param.in"))):
+    return (None, None)
+  
+  signature = get_signature(simu_path)
+  
+  simu = os.path.basename(simu_path)
+  if ((simu in cache) and (cache[simu][0] == signature)):
+    return (cache[simu][1], signature)
+  
+  # If there is Nan, we do not want to continue the simulation, but restart it, or check manually, so theses two kinds of problems are separated.
+  if has_NaN(os.path.join(simu_path, "big.dmp")):
+    return (2, signature)
+  
+  # We check if the simulation had time to finish, i.e if "Integration complete" is present in the end of the 'info.out' file
+  if not(is_finished(os.path.join(simu_path, "info.out"))):
+    return (1, signature)
+  
+  return (0, signature)
+
 #    .-.     .-.     .-.     .-.     .-.     .-.     .-.     .-.     .-. 
 #  .'   `._.'   `._.'   `._.'   `._.'   `._.'   `._.'   `._.'   `._.'   `.
 # (    .     .-.     .-.     .-.     .-.     .-.     .-.     .-.     .    )
@@ -34,83 +142,66 @@ binaryPath = os.path.join(scriptFolder, os.path.pardir)
 #  `.   .' `.   .' `.   .' `.   .' `.   .' `.   .' `.   .' `.   .' `.   .'
 #    `-'     `-'     `-'     `-'     `-'     `-'     `-'     `-'     `-'
 isOK = True # If no problems are found, this boolean help display a message that says that everything went fine.
-isRestart = False # Say if we want to re-run the simulation or not.
-isForcedStart = False # will erase output file if they exists and run all the simulations.
-isForcedContinue = False # will continue the simulation no matter what
-isMeta = False # If we consider the current folder as a folder that list sub-meta-simulations where the simulations really are
-isContinue = False # Do we want to continue simulations that did not have time to finish?
-isVerbose = False # Force display of individual information when the 'meta' option is active
-showFinished = False # By default, We only show problems. 
-WALLTIME = None
-
-isProblem = False
-problem_message = "The script can take various arguments :" + "\n" + \
-"(no spaces between the key and the values, only separated by '=')" + "\n" + \
-" * help : display a little help message on HOW to use various options" + "\n" + \
-" * meta : option that will consider the current folder as a folder that list meta simulation instead of simple simulations" + "\n" + \
-" * continue : Say that we want to continue the simulations that did not have enough time to finish" + "\n" + \
-" * restart : Say if we want to re-run the simulation in case of NaN problems" + "\n" + \
-" * force-start : will erase output file if they exists and run all the simulations." + "\n" + \
-" * force-continue : will erase output file if they exists and continue all the simulations" + "\n" + \
-" * walltime : (in hours) the estimated time for the job. Only used for avakas" + "\n" + \
-" * finished : Instead of show problems, will only show finished simulations" + "\n" + \
-" * verbose : Froce show of individual informations when the 'meta' option is active" + "\n" + \
-"" + "\n" + \
-"Example : \n" + \
-"> mercury-check-simulation.py meta restart continue\n" + \
-"will continue non finished simulation and restart thoses with NaN considering\n" + \
-" that each subfolder of the current folder contain a simulation in \n" + \
-"each sub-folder (subsubfolder of the PWD).\n" + \
-">mercury-check-simulation.py finished meta walltime=48\n" + \
-"will show the simulations that are finished. "
-
-# We get arguments from the script
-for arg in sys.argv[1:]:
-  try:
-    (key, value) = arg.split("=")
-  except:
-    key = arg
-  if (key == 'restart'):
-    isRestart = True
-  elif (key == 'force-start'):
-    isForcedStart = True
-    isRestart = False
-    isContinue = False
-  elif (key == 'force-continue'):
-    isForcedContinue = True
-    isForcedStart = False
-    isRestart = False
-    isContinue = False
-  elif (key == 'continue'):
-    isContinue = True
-  elif (key == 'verbose'):
-    isVerbose = True
-  elif (key == 'meta'):
-    isMeta = True
-  elif (key == 'walltime'):
-    WALLTIME = int(value)
-  elif (key == 'finished'):
-    showFinished = True
-  elif (key == 'help'):
-    isProblem = True
-  else:
-    print("the key '"+key+"' does not match")
-    isProblem = True
 
-if isProblem:
-  print(problem_message)
-  exit()
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, 
+description="To check if there is NaN in the orbits, or if the simulations did not have time to finish.", 
+epilog="""Options can also be given without the leading '--', as in the examples.
+
+Example : 
+> mercury-check-simulation.py meta restart continue
+will continue non finished simulation and restart thoses with NaN considering
+ that each subfolder of the current folder contain a simulation in 
+each sub-folder (subsubfolder of the PWD).
+>mercury-check-simulation.py finished meta walltime=48
+will show the simulations that are finished. """)
+parser.add_argument("--meta", action="store_true", 
+                    help="consider the current folder as a folder that list meta simulation instead of simple simulations")
+parser.add_argument("--continue", dest="continue_", action="store_true", 
+                    help="continue the simulations that did not have enough time to finish")
+parser.add_argument("--restart", action="store_true", 
+                    help="re-run the simulation in case of NaN problems")
+force_group = parser.add_mutually_exclusive_group()
+force_group.add_argument("--force-start", action="store_true", 
+                    help="erase output file if they exists and run all the simulations (override 'restart' and 'continue')")
+force_group.add_argument("--force-continue", action="store_true", 
+                    help="erase output file if they exists and continue all the simulations (override 'restart' and 'continue')")
+parser.add_argument("--walltime", type=int, 
+                    help="(in hours) the estimated time for the job. Only used for avakas")
+parser.add_argument("--finished", action="store_true", 
+                    help="Instead of show problems, will only show finished simulations")
+parser.add_argument("--verbose", action="store_true", 
+                    help="Force show of individual informations when the 'meta' option is active")
+
+# The historical syntax 'key' or 'key=value' is accepted too
+args = simulations_utilities.parse_arguments(parser)
+
+isRestart = args.restart # Say if we want to re-run the simulation or not.
+isForcedStart = args.force_start # will erase output file if they exists and run all the simulations.
+isForcedContinue = args.force_continue # will continue the simulation no matter what
+isMeta = args.meta # If we consider the current folder as a folder that list sub-meta-simulations where the simulations really are
+isContinue = args.continue_ # Do we want to continue simulations that did not have time to finish?
+isVerbose = args.verbose # Force display of individual information when the 'meta' option is active
+showFinished = args.finished # By default, We only show problems. 
+WALLTIME = args.walltime
+
+if (isForcedStart or isForcedContinue):
+  isRestart = False
+  isContinue = False
 
 if (('avakas' in hostname) and WALLTIME == None and (isContinue or isRestart or isForcedStart)):
   print("Walltime option must be set. type 'help' for a description of the options")
   exit()
 
+# mercury_utilities is only needed to submit simulations. When we only check them, we do not import it
+isSubmission = (isContinue or isRestart or isForcedStart or isForcedContinue)
+if isSubmission:
+  import mercury_utilities
+
 # We go in each sub folder of the current working directory
 
 # If sub folders are meta simulation folders instead of folders, we list the meta simulation folder to run the test in each sub folder.
 if (isMeta):
-  meta_list = [dir for dir in os.listdir(".") if (os.path.isdir(dir))]
-  meta_list.sort()
+  meta_list = simulations_utilities.list_folders(".")
 else:
   meta_list = ["."]
 
@@ -120,105 +211,89 @@ nb_finished = {}
 meta_OK = {}
 
 for meta in meta_list:
-  os.chdir(meta)
-  
   if (meta == '.'):
     absolute_parent_path = rep_exec
   else:
     absolute_parent_path = os.path.join(rep_exec, meta)
   
   # We get the list of simulations
-  simu_list = [dir for dir in os.listdir(".") if (os.path.isdir(dir))]
-  #autiwa.suppr_dossier(liste_simu,dossier_suppr)
-  simu_list.sort()
+  simu_list = simulations_utilities.list_folders(absolute_parent_path)
   
   logs[meta] = []
   nb_simulations[meta] = len(simu_list)
   finished = 0 # We initialize the number of simulations finished for this meta simulation
   
-  # We check which folders contain NaN
-  (stdout, stderr, returnCode) = autiwa.lancer_commande('grep -l "NaN" */big.dmp')
-  if (returnCode == 0):
-    NaN_folder = stdout.split("/big.dmp\n")
-    NaN_folder.remove('') # we remove an extra element that doesn't mean anything
-  else:
-    NaN_folder = []
-
-  for simu in simu_list:
-    os.chdir(simu)
-    
-    simulation_status = 0 # if 0, then the simulation ended correctly
-    
-    if not(os.path.isfile("param.in")):
-      print("%s/%s : doesn't look like a regular simulation folder" % (absolute_parent_path, simu))
-      print("\t 'param.in' does not exist, folder skipped")
-      os.chdir("..")
-      break
-    
-    
-
-    # We check if the simulation had time to finish
-    command = 'tail info.out|grep "Integration complete"|wc -l'
-    (stdout, stderr, returnCode) = autiwa.lancer_commande(command)
-    if (returnCode != 0):
-      print("The command '%s' did not end correctly" % command)
-      print(stderr)
-      pdb.set_trace()
-    is_finished = int(stdout.split("\n")[0]) # We get the number of times "Integration complete" is present in the end of the 'info.out' file
-    
-    # If there is Nan, we do not want to continue the simulation, but restart it, or check manually, so theses two kinds of problems are separated.
-    if simu not in NaN_folder:
-      if (is_finished == 0):
-        simulation_status = 1
-        
+  # We read the status of all the simulations at once, overlapping the file reads of the different simulations. 
+  # Simulations whose files did not change since the last run are not read again.
+  cache = read_cache(absolute_parent_path)
+  simu_paths = [os.path.join(absolute_parent_path, simu) for simu in simu_list]
+  with concurrent.futures.ThreadPoolExecutor(max_workers=NB_WORKERS) as executor:
+    results = list(executor.map(classify, simu_paths, itertools.repeat(cache)))
+  
+  cache = {}
+  for (simu, (simulation_status, signature)) in zip(simu_list, results):
+    if (simulation_status != None):
+      cache[simu] = (signature, simulation_status)
+  write_cache(absolute_parent_path, cache)
+  
+  # Simulations cleaned in this meta folder are submitted at the end of it, even if something goes wrong in between
+  to_submit = []
+  try:
+    for (simu, simu_path, (simulation_status, signature)) in zip(simu_list, simu_paths, results):
+      if (simulation_status == None):
+        print("%s/%s : doesn't look like a regular simulation folder" % (absolute_parent_path, simu))
+        print("\t 'param.in' does not exist, folder skipped")
+        break
+      
+      if (simulation_status != 0):
         isOK = False
-
-    else:
-      simulation_status = 2
       
-      isOK = False
-    
-    if (simulation_status == 0 and showFinished):
-      log_message = "%s/%s : The simulation is finished" % (absolute_parent_path, simu)
-    
-    elif (simulation_status == 1 and not(showFinished)):
-      log_message = "%s/%s : The simulation is not finished" % (absolute_parent_path, simu)
-    
-    elif (simulation_status == 2 and not(showFinished)):
-      log_message = "%s/%s : NaN are present" % (absolute_parent_path, simu)
-    else:
-		log_message = None
-		
-    if (log_message != None):
-      if not(isMeta):
-        print(log_message)
+      if (simulation_status == 0 and showFinished):
+        log_message = "%s/%s : The simulation is finished" % (absolute_parent_path, simu)
+      
+      elif (simulation_status == 1 and not(showFinished)):
+        log_message = "%s/%s : The simulation is not finished" % (absolute_parent_path, simu)
+      
+      elif (simulation_status == 2 and not(showFinished)):
+        log_message = "%s/%s : NaN are present" % (absolute_parent_path, simu)
       else:
-        logs[meta].append(log_message)
-    
-    if (((simulation_status != 0) and (isContinue or isRestart)) or (isForcedStart or isForcedContinue)):
-      mercury_utilities.prepareSubmission(BinaryPath=binaryPath, walltime=WALLTIME)
-    
-    # If the option 'start' is given, we force the run of the simulation, whatever there is an old simulation or not in the folder.
-    if (isForcedStart):
-      mercury_utilities.mercury_restart()
-    
-    if (((simulation_status == 1) and isContinue) or isForcedContinue):
-      mercury_utilities.mercury_continue()
-    
-    if ((simulation_status == 2) and isRestart):
-      mercury_utilities.mercury_restart()
-    
-    
-    
-    if (simulation_status == 0):
-      finished += 1
-    
-    # We get back in the parent directory
-    os.chdir("..")
+        log_message = None
+      
+      if (log_message != None):
+        if not(isMeta):
+          print(log_message)
+        else:
+          logs[meta].append(log_message)
+      
+      if (((simulation_status != 0) and (isContinue or isRestart)) or (isForcedStart or isForcedContinue)):
+        # Theses functions work on the simulation files of the current working directory
+        with simulations_utilities.working_directory(simu_path):
+          mercury_utilities.prepareSubmission(BinaryPath=binaryPath, walltime=WALLTIME)
+          
+          # If the option 'start' is given, we force the run of the simulation, whatever there is an old simulation or not in the folder.
+          if (isForcedStart):
+            mercury_utilities.mercury_restart(submit=False)
+            to_submit.append(simu_path)
+          
+          elif (((simulation_status == 1) and isContinue) or isForcedContinue):
+            mercury_utilities.mercury_continue(submit=False)
+            to_submit.append(simu_path)
+          
+          elif ((simulation_status == 2) and isRestart):
+            mercury_utilities.mercury_restart(submit=False)
+            to_submit.append(simu_path)
+      
+      if (simulation_status == 0):
+        finished += 1
+  
+  finally:
+    if isSubmission:
+      failed = mercury_utilities.submitBatch(to_submit)
+      if (failed != []):
+        isOK = False
   
   nb_finished[meta] = finished
   meta_OK[meta] = isOK
-  os.chdir(rep_exec)
 
 if isMeta:
   if isVerbose:
@@ -4,12 +4,10 @@
 # help launching some commands for all the sub-simulations of sub-sub-simulations of a given folder. 
 
 import os
-import pdb
-import autiwa
 import sys
-import subprocess
+import glob
+import argparse
 import simulations_utilities
-import mercury_utilities
 
 # Get current working directory
 rep_exec = os.getcwd()
@@ -21,6 +19,7 @@ def regen_aei_files():
   """in the current working directory, 
   will generate element.in (param.in 
   must exist) and launch 'element'."""
+  import mercury_utilities
   mercury_utilities.generateOutputs()
 
 def change_nb_outputs():
@@ -29,19 +28,21 @@ def change_nb_outputs():
   time to fit the required number of outputs.
   'param.in' must exist. But the outputs files 
   will not be re-generated"""
+  import mercury_utilities
   mercury_utilities.generateElementIN(nb_outputs=NB_OUTPUTS)
 
 def erase_aei():
   """supress all the .aei files for each simulation"""
   
-  command = "rm *.aei"
-  (stdout, stderr, returnCode) = autiwa.lancer_commande(command)
+  for filename in glob.glob("*.aei"):
+    os.remove(filename)
 
 def extend():
   """Will edit the param.* files to add 'extension' to the total integration time
   
   Parameters : extension (in years)
   """
+  import mercury_utilities
   mercury_utilities.extend_simulation(extension=EXTENSION)
 
 COMMANDS = {"regen_aei":regen_aei_files, 
@@ -67,63 +68,42 @@ for (key, value) in COMMANDS.items():
 # (    '  _  `-'  _  `-'  _  `-'  _  `-'  _  `-'  _  `-'  _  `-'  _  `    )
 #  `.   .' `.   .' `.   .' `.   .' `.   .' `.   .' `.   .' `.   .' `.   .'
 #    `-'     `-'     `-'     `-'     `-'     `-'     `-'     `-'     `-'
-isMeta = False # If we consider the current folder as a folder that list sub-meta-simulations where the simulations really are
-
-commandKey = None
-
-isProblem = False
-problem_message = "AIM : Provide a simple script that can execute " + "\n" + \
-"several commands easily for a lot of simulations at once." + "\n" + \
-"\nARGUMENTS :" + "\n" + \
-"(no spaces between the key and the values, only separated by '=')" + "\n" + \
-" * help : display a little help message on HOW to use various options" + "\n" + \
-" * meta : option that will consider the current folder as a folder that list meta simulation instead of simple simulations" + "\n" + \
-" * nb_outputs=nb : [%i] To define the number of outputs we want for .aei files. Only used by the command 'change_nb_outputs'" % NB_OUTPUTS + "\n" + \
-" * extension=nb : [%f] The time of extension for the simulations (in years). Only used by the command 'extend'" % EXTENSION + "\n" + \
-" * command=commandName : option that will consider the current folder as a folder that list meta simulation instead of simple simulations" + "\n" + \
-"   list of commands :\n" + \
-COMMANDS_HELP + \
-"\nEXAMPLE : "+ "\n" + \
-" > mercury-meta-command.py meta nb_outputs=1000 command=regen_aei "+ "\n" + \
-" In each sub folder, we will list the folders (sub-sub folders of the CWD) "+ "\n" + \
-" and consider them as simulations. For each folder, we will generate the "+ "\n" + \
-" .aei files. The option nb_outputs here will not we used, since only " + "\n" + \
-" the command '' use it to modify element.in "+ "\n"
-
-
-# We get arguments from the script
-for arg in sys.argv[1:]:
-  try:
-    (key, value) = arg.split("=")
-  except:
-    key = arg
-  if (key == 'command'):
-    commandKey = value
-  elif (key == 'meta'):
-    isMeta = True
-  elif (key == 'nb_outputs'):
-    NB_OUTPUTS = int(value)
-  elif (key == 'extension'):
-    EXTENSION = float(value)
-  elif (key == 'help'):
-    isProblem = True
-  else:
-    print("the key '"+key+"' does not match")
-    isProblem = True
-
-if (commandKey == None):
-  isProblem = True
-
-if isProblem:
-  print(problem_message)
-  exit()
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, 
+description="""AIM : Provide a simple script that can execute 
+several commands easily for a lot of simulations at once.""", 
+epilog="""list of commands :
+""" + COMMANDS_HELP + """
+Options can also be given without the leading '--', as in the example.
+
+EXAMPLE : 
+ > mercury-meta-command.py meta nb_outputs=1000 command=regen_aei 
+ In each sub folder, we will list the folders (sub-sub folders of the CWD) 
+ and consider them as simulations. For each folder, we will generate the 
+ .aei files. The option nb_outputs here will not we used, since only 
+ the command 'change_nb_outputs' use it to modify element.in 
+""")
+parser.add_argument("--command", required=True, choices=sorted(COMMANDS.keys()), 
+                    help="the command to execute in each simulation (see the list below)")
+parser.add_argument("--meta", action="store_true", 
+                    help="consider the current folder as a folder that list meta simulation instead of simple simulations")
+parser.add_argument("--nb_outputs", type=int, default=NB_OUTPUTS, 
+                    help="[%(default)i] To define the number of outputs we want for .aei files. Only used by the command 'change_nb_outputs'")
+parser.add_argument("--extension", type=float, default=EXTENSION, 
+                    help="[%(default)f] The time of extension for the simulations (in years). Only used by the command 'extend'")
+
+# The historical syntax 'key' or 'key=value' is accepted too
+args = simulations_utilities.parse_arguments(parser)
+
+isMeta = args.meta # If we consider the current folder as a folder that list sub-meta-simulations where the simulations really are
+commandKey = args.command
+NB_OUTPUTS = args.nb_outputs
+EXTENSION = args.extension
 
 # We go in each sub folder of the current working directory
 
 # If sub folders are meta simulation folders instead of folders, we list the meta simulation folder to run the test in each sub folder.
 if (isMeta):
-  meta_list = [dir for dir in os.listdir(".") if (os.path.isdir(dir))]
-  meta_list.sort()
+  meta_list = simulations_utilities.list_folders(".")
 else:
   meta_list = ["."]
 
@@ -131,8 +111,6 @@ nb_meta = len(meta_list)
 purcent_meta = 100. / float(nb_meta)
 
 for (meta_i, meta) in enumerate(meta_list):
-  os.chdir(meta)
-  
   # For the evolving purcentage of the script, the purcent at which we start, 
   # who correspond to the number of meta simulation done before and the purcentage
   # associated to each meta simulation (only equally splitted depending on the 
@@ -145,24 +123,16 @@ for (meta_i, meta) in enumerate(meta_list):
     absolute_parent_path = os.path.join(rep_exec, meta)
   
   # We get the list of simulations
-  simu_list = [dir for dir in os.listdir(".") if (os.path.isdir(dir))]
-  #autiwa.suppr_dossier(liste_simu,dossier_suppr)
-  simu_list.sort()
+  simu_list = simulations_utilities.list_folders(absolute_parent_path)
   
   nb_simus = len(simu_list)
   
   for (simu_i, simu) in enumerate(simu_list):
-    os.chdir(simu)
     purcent = purcent_offset + (simu_i + 1) / float(nb_simus) * purcent_meta
     sys.stdout.write("  %5.1f %% : %s                         \r" % (purcent, os.path.join(meta,simu)))
     sys.stdout.flush()
     
-    # We execute te required command
-    COMMANDS[commandKey]()
-    
-    # We get back in the parent directory
-    os.chdir("..")
-  
-  # We get back in the parent directory
-  os.chdir(rep_exec)
+    # We execute te required command, that work on the files of the current working directory
+    with simulations_utilities.working_directory(os.path.join(absolute_parent_path, simu)):
+      COMMANDS[commandKey]()
 
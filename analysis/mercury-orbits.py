@@ -3,16 +3,19 @@
 # v1.0
 # To display the orbits of the planets in the system in the (x,y) plane
 
-from math import *
-import pylab as pl
-import os, pdb, autiwa
+import os, autiwa
+import glob
 import numpy as np
-import sys # to be able to retrieve arguments of the script
+import argparse
+import multiprocessing
 import mercury
+import numba_utilities
+import simulations_utilities
 
 BINARY_FOLDER = '$HOME/bin/mercury'
 FRAME_PREFIX = "frame_"
 OUTPUT_EXTENSION = 'png'
+FORMAT_SORTIE = " a21e e21e i8.4 g8.4 n8.4 l8.4 m21e x21e y21e z21e" # output format needed in element.in
 
 NB_POINTS = 50 # Number of points for the display of circles
 NB_FRAMES = 2
@@ -20,54 +23,138 @@ NB_P_ORBITS = 1 # The number of orbits to display in case of tail
 
 isTail = True # There is a part where this boolean is changed automatically if the timestep between two output is to huge.
 isReferenceFrame = False # If we display orbits in the reference frame of a given planet
+NB_PROCESSES = os.cpu_count() or 1 # Maximum number of processes used to generate the frames
+
+@numba_utilities.njit(cache=True)
+def compute_frame_state(a_frame, m_frame, alive_frame, id_time, period_factor):
+  """Return a tuple of arrays (idx_tail, sizes) with, for each planet, the index 
+  where its tail start and the size of its marker, at the index 'id_time'. 
+  a_frame, m_frame and alive_frame are the columns of a, m and alive at 'id_time'. 
+  Values are 0 for planets that are no longer in the system. 
+  All the planets are done in one loop, without temporary arrays."""
+  nb_planets = a_frame.shape[0]
+  idx_tail = np.zeros(nb_planets, np.int64)
+  sizes = np.zeros(nb_planets, np.int64)
+  for planet in range(nb_planets):
+    if alive_frame[planet]:
+      # The tail start NB_P_ORBITS periods (in years) before the current time
+      tail = int(id_time + 2 - period_factor * a_frame[planet]**1.5)
+      # Negative index is not possible. So if the planet did not have the time to do one orbit, the tail will be artitificially put to 0
+      if (tail > 0):
+        idx_tail[planet] = tail
+      sizes[planet] = int(5. * m_frame[planet]**0.33)
+  
+  return (idx_tail, sizes)
+
+def create_figure():
+  """Create the figure and all the lines that will be updated for each frame. 
+  Return a tuple (fig, plot_orbits, orbit_lines, planet_markers, plot_title)"""
+  fig = pl.figure()
+  plot_orbits = fig.add_subplot(1, 1, 1)
+  plot = plot_orbits.plot
+  
+  # We put a yellow star to display the central body
+  plot(0, 0, '*', color='yellow', markersize=20) 
+  
+  # For each planet, its orbit (or tail) and its current position
+  orbit_lines = [plot([], [], color=colors[planet], label='PLANETE'+str(planet))[0] for planet in range(nb_planete)]
+  planet_markers = [plot([], [], 'o', color=colors[planet])[0] for planet in range(nb_planete)]
+  
+  plot_title = plot_orbits.set_title("")
+  plot_orbits.set_xlabel("x (in AU)")
+  plot_orbits.set_ylabel("y (in AU)")
+  
+  plot_orbits.axis('equal')
+  if (plot_range != None):
+    # We draw transparent lines to force correct display. Else, he do not necessarily display all the planets...
+    plot([-plot_range, plot_range], [0, 0], alpha=0.)
+    plot([0, 0], [-plot_range, plot_range], alpha=0.)
+  
+  plot_orbits.grid(True)
+  
+  return (fig, plot_orbits, orbit_lines, planet_markers, plot_title)
+
+def init_frame_process():
+  """Initialisation of each process that generate frames. Each process 
+  has its own figure, and only write files, so no display is needed."""
+  global figure
+  pl.switch_backend('Agg')
+  figure = create_figure()
+
+def render_frame(frame):
+  """Update the figure for the frame 'frame', a tuple (frame_i, id_time, t_frame), 
+  and write it in a file. Return the tuple (frame_i, t_frame)"""
+  (frame_i, id_time, t_frame) = frame
+  (fig, plot_orbits, orbit_lines, planet_markers, plot_title) = figure
+  
+  (idx_tail, sizes) = compute_frame_state(a[:, id_time].copy(), m[:, id_time].copy(), alive[:, id_time].copy(), id_time, period_factor)
+  
+  if not(isTail):
+    # We draw circles for each orbit. This part might be used if a delta_t is more than one orbit of a planet.
+    # The circles of all the planets are computed at once, one row per planet.
+    radius = np.hypot(x[:, id_time], y[:, id_time])
+    x_circles = radius[:, None] * cos_angles
+    y_circles = radius[:, None] * sin_angles
+  
+  # We only display the planets that are still in the system at that time
+  for planet in range(nb_planete):
+    if not(alive[planet, id_time]):
+      # The planet has been ejected
+      orbit_lines[planet].set_data([], [])
+      planet_markers[planet].set_data([], [])
+      continue
+    
+    if isTail:
+      orbit_lines[planet].set_data(x[planet, idx_tail[planet]:id_time+1], y[planet, idx_tail[planet]:id_time+1])
+    else:
+      orbit_lines[planet].set_data(x_circles[planet], y_circles[planet])
+    
+    planet_markers[planet].set_data([x[planet, id_time]], [y[planet, id_time]])
+    planet_markers[planet].set_markersize(sizes[planet])
+  
+  plot_title.set_text("T = %#.2e years" % t_frame)
+  
+  # Limits are not updated automatically when we change the data of existing lines
+  plot_orbits.relim()
+  plot_orbits.autoscale_view()
+  
+  nom_fichier_plot = "%s%0*d" % (FRAME_PREFIX, MAX_LENGTH, frame_i)
+  
+  fig.savefig("%s.%s" % (nom_fichier_plot, OUTPUT_EXTENSION), format=OUTPUT_EXTENSION)
+  
+  return (frame_i, t_frame)
 ###############################################
 ## Beginning of the program
 ###############################################
 
 
 # We get arguments from the script
-
-isProblem = False
-problem_message = "The script can take various arguments :" + "\n" + \
-"(no spaces between the key and the values, only separated by '=')" + "\n" + \
-" * t_max=1e3 : the end of the output (in years)" + "\n" + \
-" * t_min=1e4 : the beginning of the output (in years)" + "\n" + \
-" * ref=BIG_0001.aei : to display the orbits in the rotating frame of BIG_0001 planet" + "\n" + \
-" * forceCircle : to display circle instead of real orbits if the output interval is huge\n" + \
-" * zoom=1. : the farthest location in the disk that will be displayed (in AU)" + "\n" + \
-" * frames=%d : the number of frames you want" % NB_FRAMES + "\n" + \
-" * ext=%s : The extension for the output files" % OUTPUT_EXTENSION
-
-for arg in sys.argv[1:]:
-  try:
-    (key, value) = arg.split("=")
-  except:
-    key = arg
-  if (key == 't_min'):
-    t_min = float(value)
-  elif (key == 't_max'):
-    t_max = float(value)
-  elif (key == 'forceCircle'):
-    isTail = True
-  elif (key == 'frames'):
-    NB_FRAMES = int(value)
-  elif (key == 'ext'):
-    OUTPUT_EXTENSION = value
-  elif (key == 'zoom'):
-    plot_range = float(value)
-  elif (key == 'ref'):
-    isReferenceFrame = True
-    referenceFrame = value
-    NB_P_ORBITS = 20
-  elif (key == 'help'):
-    print(problem_message)
-    exit()
-  else:
-    print("the key '"+key+"' does not match")
-    isProblem = True
-
-if isProblem:
-  print(problem_message)
+parser = argparse.ArgumentParser(description="To display the orbits of the planets in the system in the (x,y) plane", 
+epilog="Options can also be given without the leading '--' (e.g 'frames=10').")
+parser.add_argument("--t_min", type=float, help="the beginning of the output (in years)")
+parser.add_argument("--t_max", type=float, help="the end of the output (in years)")
+parser.add_argument("--ref", metavar="BIG_0001.aei", 
+                    help="to display the orbits in the rotating frame of BIG_0001 planet")
+parser.add_argument("--forceCircle", action="store_true", 
+                    help="to display circle instead of real orbits if the output interval is huge")
+parser.add_argument("--zoom", type=float, help="the farthest location in the disk that will be displayed (in AU)")
+parser.add_argument("--frames", type=int, default=NB_FRAMES, help="[%(default)d] the number of frames you want")
+parser.add_argument("--ext", default=OUTPUT_EXTENSION, help="[%(default)s] The extension for the output files")
+
+# The historical syntax 'key' or 'key=value' is accepted too
+args = simulations_utilities.parse_arguments(parser)
+
+t_min = args.t_min
+t_max = args.t_max
+plot_range = args.zoom
+NB_FRAMES = args.frames
+OUTPUT_EXTENSION = args.ext
+if args.forceCircle:
+  isTail = False
+if (args.ref != None):
+  isReferenceFrame = True
+  referenceFrame = args.ref
+  NB_P_ORBITS = 20
 
 if (NB_FRAMES <= 1):
   print("The number of frames cannot be lower than 2")
@@ -77,12 +164,17 @@ if (NB_FRAMES <= 1):
 # We erase old output files, add 'x, y and z' to the outputs values, and generate new output files
 ####################
 
-autiwa.lancer_commande("rm *.aei element.out")
+for filename in glob.glob("*.aei"):
+  os.remove(filename)
+if os.path.isfile("element.out"):
+  os.remove("element.out")
 
 elementin = mercury.Element()
 elementin.read()
-elementin.set_format_sortie(" a21e e21e i8.4 g8.4 n8.4 l8.4 m21e x21e y21e z21e")
-elementin.write()
+# element.in is only rewritten if the output format is not already the one we need
+if (elementin.format_sortie.split() != FORMAT_SORTIE.split()):
+  elementin.set_format_sortie(FORMAT_SORTIE)
+  elementin.write()
 
 (stdout, stderr, returnCode) = autiwa.lancer_commande(os.path.join(BINARY_FOLDER, "element"))
 if (returnCode != 0):
@@ -91,14 +183,11 @@ if (returnCode != 0):
 ####################
 # On recupere la liste des fichiers planetes.aei
 ####################
-(process_stdout, process_stderr, return_code) = autiwa.lancer_commande("ls *.aei")
-if (return_code != 0):
-  print("the command return an error "+str(return_code))
-  print(process_stderr)
+liste_aei = sorted(glob.glob("*.aei")) # sorted, in the same order as 'ls'
+if (liste_aei == []):
+  print("No .aei files were found")
   exit()
-  
-liste_aei = process_stdout.split("\n")
-liste_aei.remove('') # we remove an extra element that doesn't mean anything
+
 nb_planete = len(liste_aei)
 
 if isReferenceFrame:
@@ -109,72 +198,29 @@ if isReferenceFrame:
 ####################
 # On lit, pour chaque planete, le contenu du fichier et on stocke les variables qui nous interessent.
 ####################
-t = [] # temps en annee
-a = [] # the semi major axis in AU
-m = [] # mass in earth mass
-x = [] # x cartesian coordinate in AU
-y = [] # y cartesian coordinate in AU
-z = [] # z cartesian coordinate in AU
-
+# Orbital elements of each planet, as a 2D array with the columns (t, a, m, x, y, z) : 
+# time in years, semi major axis in AU, mass in earth mass and cartesian coordinates in AU
+datas = []
 
 # On recupere les donnees orbitales
 for planete in range(nb_planete):
   
   fichier_source = liste_aei[planete]
-  tableau = open(fichier_source, 'r')
-  
-  tp = [] # time in year
-  ap = [] # the Semi-major axis in AU
-  mp = [] # mass in earth mass
-  xp = [] # x en ua
-  yp = [] # y en ua
-  zp = [] # z en ua
   
-  tappend = tp.append
-  aappend = ap.append
-  mappend = mp.append
-  xappend = xp.append
-  yappend = yp.append
-  zappend = zp.append
+  # 4 lines of header. Columns are t, a, e, i, g, n, l, m, x, y, z
+  # In case of ejection, prevent the scrip to crash. "avoid problem of NaN and ******" : 
+  # values that can't be converted are read as NaN and the corresponding lines are discarded.
+  data = np.genfromtxt(fichier_source, skip_header=4, usecols=(0, 1, 7, 8, 9, 10), 
+                       invalid_raise=False, filling_values=np.nan)
+  data = data.reshape(-1, 6) # to always have a 2D array, even for files with 0 or 1 line
+  data = data[~np.isnan(data).any(axis=1)]
   
-  # 3 lines of header
-  for indice in range(3):
-    tableau.readline()
-
-  entete = tableau.readline()
-  for ligne in tableau:
-    colonne = ligne.split()
-    
-
-    # In case of ejection, prevent the scrip to crash. "avoid problem of NaN and ******"
-    try:
-      ti = float(colonne[0])
-      ai = float(colonne[1])
-      mi = float(colonne[7]) / 3.00374072e-6 # in solar mass
-      xi = float(colonne[8])
-      yi = float(colonne[9])
-      zi = float(colonne[10])
-      
-      # We must append inside the 'try' to avoid appending a value twice. The problem should occurs before anyway, when trying to convert into float
-      tappend(ti)
-      aappend(ai)
-      mappend(mi)
-      xappend(xi)
-      yappend(yi)
-      zappend(zi)
-    except:
-      pass
-  tableau.close()
+  data[:, 2] /= 3.00374072e-6 # in earth mass
   
-  t.append(np.array(tp))
-  a.append(np.array(ap))
-  m.append(np.array(mp))
-  x.append(np.array(xp))
-  y.append(np.array(yp))
-  z.append(np.array(zp))
+  datas.append(data)
 
 # The separation between outputs is not always the same because the real output interval in mercury and element might be slightly different.
-delta_t = (t[0][-1] - t[0][0]) / float(len(t[0]))
+delta_t = (datas[0][-1, 0] - datas[0][0, 0]) / float(len(datas[0]))
 
 # If the timestep between two outputs is to big, we do not display a tail, because the planet will have time to do more than one 
 # orbit between two values 
@@ -182,18 +228,27 @@ if (delta_t > 10.):
   print("/!\ time between output will have the effect to display ugly orbits. \
   Try the option 'isTail=False', but orbits will be circle and not representative of reality")
 
-# We get the array of reference time, i.e, one of the longuest list of time available in the list of planets. 
-ref_len = 0
-ref_id = 0
-for planet in range(nb_planete):
-  len_i = len(t[planet])
-  if (len_i > ref_len):
-    ref_len = len_i
-    ref_id = planet
+# We get the length of the reference time, i.e, one of the longuest list of time available in the list of planets. 
+lengths = [len(data) for data in datas]
+ref_id = int(np.argmax(lengths))
+ref_len = lengths[ref_id]
+
+# We store each quantity in a 2D array (planet, time) to be able to work on all the planets at once. 
+# Planets are all read from the same time, but can be ejected before the end of the simulation. 
+# 'alive' is True when the planet is still in the system, the other values are set to NaN.
+# All the arrays are allocated at once, and each planet is copied directly at its place.
+alive = np.zeros((nb_planete, ref_len), dtype=bool)
+orbits = np.full((6, nb_planete, ref_len), np.nan)
+for (planet, data) in enumerate(datas):
+  alive[planet, :len(data)] = True
+  orbits[:, planet, :len(data)] = data.T
+del datas
+
+(t, a, m, x, y, z) = orbits
 ref_time = t[ref_id]
 
 # We get the index for the t_max value
-if ('t_max' in locals()):
+if (t_max != None):
   id_max = int((t_max - ref_time[0]) / delta_t)
   t_max = ref_time[id_max]
 else:
@@ -201,7 +256,7 @@ else:
   t_max = ref_time[-1]
 
 # We get the index for the t_max value
-if ('t_min' in locals()):
+if (t_min != None):
   id_min = int((t_min - ref_time[0]) / delta_t)
   t_min = ref_time[id_min]
 else:
@@ -212,20 +267,23 @@ if isReferenceFrame:
   x_ref = x[ID_reference]
   y_ref = y[ID_reference]
   
-  omega = -2. * np.arctan(y_ref / (x_ref + np.sqrt(x_ref**2 + y_ref**2)))
+  # arctan2 is the polar angle, equal to 2*arctan(y/(x+r)), but without 
+  # the singularity on the negative x axis (x + r = 0)
+  omega = -np.arctan2(y_ref, x_ref)
   
-  r = []
-  for planet in range(nb_planete):
-    ri = np.sqrt(x[planet]**2 + y[planet]**2)
-    r.append(ri)
-    theta = 2. * np.arctan(y[planet] / (x[planet] + ri))
-    x[planet] = ri * np.cos(theta + omega)
-    y[planet] = ri * np.sin(theta + omega)
+  # omega (time) is broadcasted along the planet axis of x and y (planet, time)
+  r = np.hypot(x, y)
+  angle = np.arctan2(y, x)
+  angle += omega
+  x = r * np.cos(angle)
+  y = r * np.sin(angle)
 
 
 
 # on trace les plots
-autiwa.lancer_commande("rm %s*" % FRAME_PREFIX) # We delete the previous frames
+# We delete the previous frames
+for filename in glob.glob("%s*" % FRAME_PREFIX):
+  os.remove(filename)
 
 delta_t_min = (t_max - t_min) / (float(NB_FRAMES -1.))
 # Number of timestep between each frame
@@ -240,82 +298,49 @@ if (ts_per_frame < 1):
 
 
 # We generate a list of colors
-tmp = autiwa.colorList(nb_planete)
 colors = [ '#'+li for li in autiwa.colorList(nb_planete)]
 
 if not(isTail):
-  angles = [2 * pi / NB_POINTS * i for i in range(NB_POINTS)]
-  angles.append(angles[0]) # we want to have a full circle, perfectly closed
-  angles = np.array(angles)
+  # The last point is the first one, we want to have a full circle, perfectly closed
+  angles = np.linspace(0, 2 * np.pi, NB_POINTS + 1)
+  cos_angles = np.cos(angles)
+  sin_angles = np.sin(angles)
 
 
-fig = pl.figure()
-plot_orbits = fig.add_subplot(1, 1, 1)
-plot = plot_orbits.plot
 MAX_LENGTH = len(str(NB_FRAMES)) # The maximum number of characters needed to display
 
+# We compute the index and time of all the frames at once
+frame_steps = (np.arange(1, NB_FRAMES+1) * ts_per_frame).astype(int)
+frame_indices = id_min + frame_steps
+frame_times = t_min + frame_steps * delta_t
 
-for frame_i in range(1, NB_FRAMES+1):
-  id_time = id_min + int(frame_i * ts_per_frame)
-  t_frame = t_min + int(frame_i * ts_per_frame) * delta_t
-  
-  if (frame_i == NB_FRAMES - 1):
-    id_time = id_max
-    t_frame = t_max
-  
-  print("frame %*d : T = %#.2e years" % (MAX_LENGTH, frame_i, t_frame))
-  
+frame_indices[NB_FRAMES-2] = id_max # index of frame NB_FRAMES-1
+at_max = (frame_indices >= id_max)
+frame_indices[at_max] = id_max
+frame_times[at_max] = t_max
 
-  plot_orbits.clear()
+# Factor to get the number of outputs of the tail from the period (in years) of a planet.
+period_factor = NB_P_ORBITS / delta_t
 
-  # We put a yellow star to display the central body
-  plot(0, 0, '*', color='yellow', markersize=20) 
+frames = list(zip(range(1, NB_FRAMES+1), frame_indices, frame_times))
 
-  if isTail:
-    idx_tail = [None] * nb_planete
-    for planet in range(nb_planete):
-      # If the planet is still in the system at that time, we display it, else, the 'except' make us pass to the next planet.
-      try:
-        
-        tmp = a[planet][id_time]**1.5 # the period of the planet in years
-        tmp = int(id_time - NB_P_ORBITS * tmp / delta_t + 2)
-        # Negative index is not possible. So if the planet did not have the time to do one orbit, the tail will be artitificially put to 0
-        if (tmp < 0):
-          tmp = 0
-        idx_tail[planet] = tmp
-        plot(x[planet][idx_tail[planet]:id_time+1], y[planet][idx_tail[planet]:id_time+1], color=colors[planet], label='PLANETE'+str(planet))
-        plot(x[planet][id_time], y[planet][id_time], 'o', color=colors[planet], markersize=int(5* (m[planet][id_time])**0.33))
-      except:
-        pass
-        # The planet has been ejected
-  else:
-    # We draw circles for each orbit. This part might be used if a delta_t is more than one orbit of a planet.
-    for planet in range(nb_planete):
-      try:
-        r = sqrt(x[planet][id_time]**2 + y[planet][id_time]**2)
-        x_circ = r * np.cos(angles)
-        y_circ = r * np.sin(angles)
-        plot(x_circ, y_circ, color=colors[planet], label='PLANETE'+str(planet))
-        plot(x[planet][id_time], y[planet][id_time], 'o', color=colors[planet], markersize=int(5* (m[planet][id_time])**0.33))
-      except:
-        pass
-        #~ # The planet has been ejected
-  plot_orbits.set_title("T = %#.2e years" % t_frame)
-  plot_orbits.set_xlabel("x (in AU)")
-  plot_orbits.set_ylabel("y (in AU)")
-  
-  pl.axis('equal')
-  if ('plot_range' in vars()):
-    # We draw transparent lines to force correct display. Else, he do not necessarily display all the planets...
-    plot([-plot_range, plot_range], [0, 0], alpha=0.)
-    plot([0, 0], [-plot_range, plot_range], alpha=0.)
-    
-  
-  plot_orbits.grid(True)
-  nom_fichier_plot = "%s%0*d" % (FRAME_PREFIX, MAX_LENGTH, frame_i)
-  
-  fig.savefig("%s.%s" % (nom_fichier_plot, OUTPUT_EXTENSION), format=OUTPUT_EXTENSION)
+# pylab is only needed to generate the frames, we do not import it before the orbits are read
+import pylab as pl
 
 if (NB_FRAMES<3):
+  # Few frames, that we want to display at the end
+  figure = create_figure()
+  for frame in frames:
+    (frame_i, t_frame) = render_frame(frame)
+    print("frame %*d : T = %#.2e years" % (MAX_LENGTH, frame_i, t_frame))
+  
   pl.show()
-
+else:
+  # Frames are independant, we generate them in parallel. With 'fork', the processes 
+  # get the orbits from the current process without having to copy them for each frame. 
+  # Each process creates its own figure, so we do not start more processes than frames.
+  pool = multiprocessing.get_context('fork').Pool(processes=min(NB_FRAMES, NB_PROCESSES), initializer=init_frame_process)
+  for (frame_i, t_frame) in pool.imap_unordered(render_frame, frames):
+    print("frame %*d : T = %#.2e years" % (MAX_LENGTH, frame_i, t_frame))
+  pool.close()
+  pool.join()
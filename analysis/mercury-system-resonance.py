@@ -9,10 +9,14 @@
 # that refeered to different times during the simulation)
 
 import pdb # Pour le debug
+import os
+import math
+import ast
+import concurrent.futures
 import numpy as np
-from fractions import Fraction
 import pylab as pl
 import autiwa
+import numba_utilities
 import sys # to get access to arguments of the script
 
 ################
@@ -21,10 +25,12 @@ import sys # to get access to arguments of the script
 NOM_FICHIER_PLOT = "system_resonances"
 OUTPUT_EXTENSION = "pdf"
 
-DENOMINATOR_LIMIT = 30 # Maximum value allowed of the denominator when we want to get a fraction from a decimal value
-NUMBER_OF_VALUES = 100 # sampling for period ratio around the given value
+DENOMINATOR_LIMIT = 30 # Maximum value allowed of the denominator of the possible resonances
+PERIOD_RATIO_LIMIT = 10 # Maximum period ratio between two neighbouring planets for which we search resonances
 UNCERTAINTY = 5 # In percentage
 NB_LAST_POINTS = 50 # Number of points we want to test the libration of angles.
+TAIL_SIZE = 8192 # Number of bytes first read at the end of the .aei files to get the last points
+NB_WORKERS = 8 # Number of threads used to read the .aei files in parallel
 
 # the threshold of the standard deviation of a resonant angle, 
 # below which we consider there is libration and thus, a resonance.
@@ -35,47 +41,126 @@ STD_THRESHOLD = 40
 ANGLE_MIN = - 180.
 ANGLE_MAX = 180.
 
-def plot_res():
-  # We chose the number of plot in x and y axis for the p.multi
-  # environment in order to plot ALL the resonant angles and have x and
-  # y numbers as close on from another as possible. There are q+1
-  # resonant angles, the period ratio and w1 - w2, i.e q+3 plots
-  nb_plots_x = 1
-  nb_plots_y = 1
-  while (nb_plots_x * nb_plots_y < q+2):
-    if (nb_plots_x == nb_plots_y):
-      nb_plots_y += 1
-    else:
-      nb_plots_x += 1
+def tail(filename, nb_lines, nb_header=4):
+  """Return the list of the 'nb_lines' last lines of the file 'filename', 
+  without the 'nb_header' lines of header. Only the end of the file is read, 
+  the size of the block read being doubled until there is enough lines."""
+  block_size = TAIL_SIZE
+  with open(filename, 'rb') as source:
+    source.seek(0, os.SEEK_END)
+    file_size = source.tell()
+    while True:
+      start = max(0, file_size - block_size)
+      source.seek(start)
+      lines = source.read().decode().splitlines()
+      if (start == 0):
+        # The whole file has been read
+        lines = lines[nb_header:]
+        break
+      
+      # The first line is probably incomplete
+      lines = lines[1:]
+      if (len(lines) >= nb_lines):
+        break
+      block_size *= 2
+  
+  return lines[-nb_lines:]
+
+def load_aei(name):
+  """Return a tuple of arrays (t, a, g, n, M) for the NB_LAST_POINTS last outputs 
+  of the planet 'name', read in the file 'name.aei' : 
+  t : time in years
+  a : demi-grand axe en ua
+  g : argument of pericentre (degrees)
+  n : longitude of ascending node (degrees)
+  M : Mean anomaly (degrees)
+  The angles are in simple precision, the time stays in double precision.
+  """
+  # Columns are t, a, e, i, g, n, l, m, ... We only read the last lines of the file, not the whole trajectory.
+  # values that can't be converted (NaN or ******) are read as NaN and the corresponding lines are discarded.
+  lines = tail(name+".aei", NB_LAST_POINTS)
+  data = np.genfromtxt(lines, usecols=(0, 1, 4, 5, 6), invalid_raise=False, filling_values=np.nan)
+  data = data.reshape(-1, 5) # to always have a 2D array, even for files with 0 or 1 line
+  data = data[~np.isnan(data).any(axis=1)]
+  
+  # Each angle is stored contiguously, in simple precision, enough for degrees with a std threshold of STD_THRESHOLD
+  angles = np.array(data[:, 2:].T, dtype=np.float32, order='C')
+  
+  return (data[:, 0], data[:, 1]) + tuple(angles)
+
+def farey_in_interval(lower, upper, max_denominator):
+  """Generator of the tuples (numerator, denominator) of all the fractions between 'lower' 
+  and 'upper' with a denominator lower or equal to 'max_denominator', in increasing order. 
+  Between two consecutive integers n and n+1, the fractions are the Farey sequence of order 
+  'max_denominator' shifted by n. We walk each of these intervals iteratively from n/1, 
+  each term being obtained from the two previous ones, so that there is no recursion."""
+  for n in range(int(math.floor(lower)), int(math.floor(upper)) + 1):
+    # The two first terms of the sequence between n/1 and (n+1)/1
+    (numerator, denominator) = (n, 1)
+    (next_numerator, next_denominator) = (n * max_denominator + 1, max_denominator)
+    # (n+1)/1 is the first term of the next interval
+    while ((numerator, denominator) != (n + 1, 1)):
+      if (numerator > upper * denominator):
+        return
+      if (lower * denominator <= numerator):
+        yield (numerator, denominator)
+      k = (max_denominator + denominator) // next_denominator
+      (numerator, denominator, next_numerator, next_denominator) = (next_numerator, next_denominator, 
+                            k * next_numerator - numerator, k * next_denominator - denominator)
+
+@numba_utilities.njit(cache=True)
+def score_resonance(inner_period_nb, outer_period_nb, mean_longitude_inner, mean_longitude_outer, long_of_peri_inner, long_of_peri_outer):
+  """Return the minimum of the standard deviations of the q+1 resonant angles of 
+  the resonance (p+q):p = inner_period_nb:outer_period_nb. 
+  All the angles are computed, folded and summed in one single pass over the points, 
+  the mean and the standard deviation being obtained from the sums of phi and phi**2."""
+  q = inner_period_nb - outer_period_nb
+  nb_points = mean_longitude_inner.shape[0]
+  
+  sum_phi = np.zeros(q+1)
+  sum_phi2 = np.zeros(q+1)
+  for k in range(nb_points):
+    # phi_i = (p+q) * l2 - p * l1 - i * w1 - (q-i) * w2 = [(p+q) * l2 - p * l1 - q * w2] - i * (w1 - w2)
+    # We take modulo 2*pi of the resonant angle minus ANGLE_MIN, i.e between 0 and 360. 
+    # Adding back ANGLE_MIN would not change the standard deviation, so we do not do it.
+    resonance_term = inner_period_nb * mean_longitude_outer[k] - outer_period_nb * mean_longitude_inner[k] - q * long_of_peri_outer[k] - ANGLE_MIN
+    delta_long_of_peri = long_of_peri_inner[k] - long_of_peri_outer[k]
+    for i in range(q+1):
+      phi = (resonance_term - i * delta_long_of_peri) % 360.
+      sum_phi[i] += phi
+      sum_phi2[i] += phi * phi
+  
+  mean_phi = sum_phi / nb_points
+  std = np.sqrt(np.maximum(sum_phi2 / nb_points - mean_phi * mean_phi, 0.))
+  
+  return std.min()
+
+def score_resonance_numpy(inner_period_nb, outer_period_nb, mean_longitude_inner, mean_longitude_outer, long_of_peri_inner, long_of_peri_outer):
+  """Same as score_resonance(), but the q+1 resonant angles are computed at once 
+  in a (q+1, nb_points) array. Used when numba is not available."""
+  q = inner_period_nb - outer_period_nb
+  
+  # phi_i = [(p+q) * l2 - p * l1 - q * w2] - i * (w1 - w2), taken modulo 2*pi after removing ANGLE_MIN
+  resonance_term = inner_period_nb * mean_longitude_outer - outer_period_nb * mean_longitude_inner - q * long_of_peri_outer - ANGLE_MIN
+  delta_long_of_peri = long_of_peri_inner - long_of_peri_outer
+  phi = np.mod(resonance_term - np.arange(q+1)[:, np.newaxis] * delta_long_of_peri, 360.)
+  
+  return phi.std(axis=1, dtype=np.float64).min()
+
+def resonant_angles_std(resonances, mean_longitude_inner, mean_longitude_outer, long_of_peri_inner, long_of_peri_outer):
+  """Return an array with, for each resonance (p+q):p of the list of tuples (p+q, p) 'resonances', 
+  the minimum of the standard deviations of its q+1 resonant angles (see score_resonance())"""
+  # Without numba, the kernel would loop over the points in the interpreter, numpy is faster in that case
+  if numba_utilities.NUMBA_AVAILABLE:
+    score = score_resonance
+  else:
+    score = score_resonance_numpy
   
-  # on trace les plots
-
-  pl.figure(1) 
-  pl.clf() # On cree des sous plots. Pour subplot(311), Ca signifie qu'on a 2 lignes, 3 colonnes, et que le subplot 
-  # courant est le 1e. (on a donc 2*3=6 plots en tout)
-
-  # We create a variable to store the index of the subplot
-  subplot_index = nb_plots_x * 100 + nb_plots_y * 10
-  pl.suptitle("resonance "+str(res.numerator)+":"+str(res.denominator)+" between "+name[planet]+" and "+name[planet+1])
-
-  subplot_index += 1
-  pl.subplot(subplot_index)
-  pl.plot(t_inner, delta_longitude)
-  pl.xlabel(unicode("time [years]",'utf-8'))
-  pl.ylabel(unicode("w2 - w1",'utf-8'))
-  #~ pl.legend()
-  pl.grid(True)
-
-  for i in range(q+1):
-    subplot_index += 1
-    pl.subplot(subplot_index)
-    pl.plot(t_inner, phi[i])
-    pl.xlabel(unicode("time [years]",'utf-8'))
-    pl.ylabel(unicode("φ"+str(i),'utf-8'))
-    #~ pl.legend()
-    pl.grid(True)
+  min_std = np.empty(len(resonances))
+  for (index, (numerator, denominator)) in enumerate(resonances):
+    min_std[index] = score(numerator, denominator, mean_longitude_inner, mean_longitude_outer, long_of_peri_inner, long_of_peri_outer)
   
-  pl.show()
+  return min_std
 
 ###############################################
 ## Beginning of the program
@@ -101,7 +186,7 @@ for arg in sys.argv[1:]:
   if (key == 'ext'):
     OUTPUT_EXTENSION = value
   elif (key == 'cz'):
-    CZ = eval(value)
+    CZ = ast.literal_eval(value)
   elif (key == 'help'):
     print(problem_message)
     exit()
@@ -115,33 +200,19 @@ if isProblem:
 uncertainty = 0.01 * float(UNCERTAINTY)
 
 # To each planet named "planet01" exist a "planet01.aei" file that contains its coordinates with time.
-name = [] # the name of the planets in the current simulation. 
-a = [] # semi major axis (in AU)
-e = [] # eccentricity
-mass = [] # mass in earth mass
+# 5 lines of header. Columns are name, a, e, i, mass, ...
+# The file is read once as strings, the name of the planets being in the first column.
+table = np.loadtxt("element.out", skiprows=5, usecols=(0, 1, 2, 4), dtype=str, ndmin=2)
 
-table = open("element.out", 'r')
+name = table[:, 0].tolist() # the name of the planets in the current simulation. 
+# semi major axis (in AU), eccentricity and mass in earth mass
+(a, e, mass) = table[:, 1:].astype(float).T
 
-# We get rid of the header
-for i in range(5):
-  table.readline()
+nb_planets = len(name)
 
-lines = table.readlines()
-table.close()
-
-nb_planets = len(lines)
-
-for line in lines:
-  datas = line.split()
-  name.append(datas[0])
-  a.append(float(datas[1]))
-  e.append(float(datas[2]))
-  mass.append(float(datas[4]))
-
-a = np.array(a)
-e = np.array(e)
-
-period = a**1.5
+period = a * np.sqrt(a)
+# The period ratio between each planet and the next one. The value at the index 'i' is for planets i and i+1
+period_ratios = period[1:] / period[:-1]
 
 # We initialize the arrays where we store the presence of resonances. 
 # The value at the index 'i' represent the presence of a resonance between planet i and i+1
@@ -150,104 +221,25 @@ longitude_res = [False] * (nb_planets - 1)
 # You can't use the formulation above, because all the items will be linked, and an append, will add an element to all the sublists.
 extra_mean_motion_res = [[] for i in range(nb_planets-1)] 
 
-t_inner = [] # time in years
-a_inner = [] # demi-grand axe en ua
-g_inner = [] # argument of pericentre (degrees)
-n_inner = [] # longitude of ascending node (degrees)
-M_inner = [] # Mean anomaly (degrees)
-
-t_outer = [] # time in years
-a_outer = [] # demi-grand axe en ua
-g_outer = [] # argument of pericentre (degrees)
-n_outer = [] # longitude of ascending node (degrees)
-M_outer = [] # Mean anomaly (degrees)
-
-fichier_source = name[0]+".aei"
-tableau = open(fichier_source, 'r')
-
-# we skip the three first lines
-for indice in range(3):
-    tableau.readline()
-# we store the fourth line that contains the description of all the columns
-entete = tableau.readline()
-
-lines = tableau.readlines()
-tableau.close()
-
-for ligne in lines[-NB_LAST_POINTS:]:
-  colonne = ligne.split()
-  
-  try:
-    ti = float(colonne[0])
-    ai = float(colonne[1])
-    gi = float(colonne[4])
-    ni = float(colonne[5])
-    Mi = float(colonne[6])
-  except:
-    pass
-  t_outer.append(ti)
-  a_outer.append(ai)
-  g_outer.append(gi)
-  n_outer.append(ni)
-  M_outer.append(Mi)
-
-# We convert to numpy arrays, to have faster calculations
-a_outer = np.array(a_outer)
-g_outer = np.array(g_outer)
-n_outer = np.array(n_outer)
-M_outer = np.array(M_outer)
+# We read the coordinates of all the planets at once, the files being read in parallel
+with concurrent.futures.ThreadPoolExecutor(max_workers=NB_WORKERS) as executor:
+  aei_datas = list(executor.map(load_aei, name))
 
 #~ nb_planets=2
 for planet in range(0, nb_planets-1):
-  # We read the coordinates of the next planet and exchange the values between inner and outer
-  t_inner = t_outer
-  a_inner = a_outer
-  g_inner = g_outer
-  n_inner = n_outer
-  M_inner = M_outer
-  
-  t_outer = [] # time in years
-  a_outer = [] # demi-grand axe en ua
-  g_outer = [] # argument of pericentre (degrees)
-  n_outer = [] # longitude of ascending node (degrees)
-  M_outer = [] # Mean anomaly (degrees)
-  
-  fichier_source = name[planet+1]+".aei"
-  tableau = open(fichier_source, 'r')
-
-  # we skip the three first lines
-  for indice in range(3):
-      tableau.readline()
-  # we store the fourth line that contains the description of all the columns
-  entete = tableau.readline()
-  
-  lines = tableau.readlines()
-  tableau.close()
-  
-  for ligne in lines[-NB_LAST_POINTS:]:
-    colonne = ligne.split()
-    
-    try:
-      ti = float(colonne[0])
-      ai = float(colonne[1])
-      gi = float(colonne[4])
-      ni = float(colonne[5])
-      Mi = float(colonne[6])
-    except:
-      pass
-    t_outer.append(ti)
-    a_outer.append(ai)
-    g_outer.append(gi)
-    n_outer.append(ni)
-    M_outer.append(Mi)
+  (t_inner, a_inner, g_inner, n_inner, M_inner) = aei_datas[planet]
+  (t_outer, a_outer, g_outer, n_outer, M_outer) = aei_datas[planet+1]
   
-  a_outer = np.array(a_outer)
-  g_outer = np.array(g_outer)
-  n_outer = np.array(n_outer)
-  M_outer = np.array(M_outer)
+  # Unreadable lines are dropped separately for each planet, so we only keep the times that exist for both planets
+  (t_common, inner_index, outer_index) = np.intersect1d(t_inner, t_outer, return_indices=True)
+  if (len(t_common) == 0):
+    print("No common output time between %s and %s, the pair is skipped" % (name[planet], name[planet+1]))
+    continue
+  (g_inner, n_inner, M_inner) = (g_inner[inner_index], n_inner[inner_index], M_inner[inner_index])
+  (g_outer, n_outer, M_outer) = (g_outer[outer_index], n_outer[outer_index], M_outer[outer_index])
   
   # We get the various possible resonance between the two planets
-  periodRatio = period[planet+1] / period[planet]
+  periodRatio = period_ratios[planet]
   
   periodMin = periodRatio * (1 - uncertainty)
   periodMax = periodRatio * (1 + uncertainty)
@@ -256,82 +248,45 @@ for planet in range(0, nb_planets-1):
   if (periodMin < 1.):
     periodMin = 1.
   
-  periodWidth = periodMax - periodMin
-  deltaPeriod = periodWidth/NUMBER_OF_VALUES
+  # All the fractions in the interval are possible resonances. Since periodMin >= 1, 
+  # their order q is positive. They are sorted from the smallest one (in number) to the biggest one.
+  # Planets too far from each other would give thousands of candidates of very high order, we do not test them.
+  if (periodMin > PERIOD_RATIO_LIMIT):
+    resonances = []
+  else:
+    resonances = sorted(farey_in_interval(periodMin, periodMax, DENOMINATOR_LIMIT))
+  #~ resonances = [(9, 8)]
   
+  # We calculate the resonant angles
+  long_of_peri_inner = g_inner + n_inner
+  mean_longitude_inner = M_inner + long_of_peri_inner
   
-  periods = [periodMin + deltaPeriod * i for i in range(NUMBER_OF_VALUES)]
-
-  resonances = []
-  for period_i in periods:
-    fraction = Fraction(period_i).limit_denominator(DENOMINATOR_LIMIT)
-    #print(fraction)
-    resonances.append(fraction)
-
-  # We exclude all values that appears several time to only keep one occurence of each value
-  resonances = list(set(resonances))
-  #~ resonances = [Fraction(9,8)]
+  long_of_peri_outer = g_outer + n_outer
+  mean_longitude_outer = M_outer + long_of_peri_outer
   
-  # For each resonance we check if this one exist between the two considered planets
-  for res in resonances:
-    outer_period_nb = res.denominator
-    inner_period_nb = res.numerator
-    
-    # Resonances are usually displayed as (p+q):p where q is the order of
-    # the resonance. We retreive thoses parameters
-    p = outer_period_nb
-    q = inner_period_nb - outer_period_nb
-
-    # We calculate the resonant angles
-    long_of_peri_inner = g_inner + n_inner
-    mean_longitude_inner = M_inner + long_of_peri_inner
-
-    long_of_peri_outer = g_outer + n_outer
-    mean_longitude_outer = M_outer + long_of_peri_outer
-
-    phi = np.empty((q+1, NB_LAST_POINTS)) # we create an array, empty for the moment, that will contain all the resonant angles associated with the supposed resonance.
-
-    temp_value = inner_period_nb * mean_longitude_outer - outer_period_nb * mean_longitude_inner
-
-    for i in range(q+1):
-      phi[i] = temp_value - i * long_of_peri_inner - (q - i) * long_of_peri_outer
-
-    # We take modulo 2*pi of the resonant angle
-    phi = phi%(360.)
-    too_low = phi < ANGLE_MIN
-    too_high = phi > ANGLE_MAX
-    phi[too_low] = phi[too_low] + 360.
-    phi[too_high] = phi[too_high] - 360.
-
-    delta_longitude = long_of_peri_outer - long_of_peri_inner
-    delta_longitude = delta_longitude%(360.)
-    too_low = delta_longitude < ANGLE_MIN
-    too_high = delta_longitude > ANGLE_MAX
-    delta_longitude[too_low] = delta_longitude[too_low] + 360.
-    delta_longitude[too_high] = delta_longitude[too_high] - 360.
-    
+  # For each resonance we check if this one exist between the two considered planets. 
+  standard_deviations = resonant_angles_std(resonances, mean_longitude_inner, mean_longitude_outer, long_of_peri_inner, long_of_peri_outer)
+  
+  # The difference of longitude of pericentre does not depend on the resonance
+  delta_longitude = np.mod(long_of_peri_outer - long_of_peri_inner - ANGLE_MIN, 360.) + ANGLE_MIN
+  
+  if (delta_longitude.std() < STD_THRESHOLD):
+    longitude_res[planet] = True
+  
+  for (res, standard_deviation) in zip(resonances, standard_deviations):
     # If one of the std's is small (Typically, around 25, but 
     # I had once a 80 that was not a resonance, so I think a threshold around 40 is a good one)
-    standard_deviation = min(phi.std(1))
-      
     if (standard_deviation < STD_THRESHOLD):
       #~ pdb.set_trace()
       #~ pdb.set_trace()
+      # If there are several resonances, we store the smallest one (in number) 
+      # as main resonance, i.e the first one found, and a list of all other resonances elsewhere.
       if (mean_motion_res[planet] == None):
         mean_motion_res[planet] = res
       else:
-        # If there are several resonances, we store the smallest one (in number) 
-        # as main resonance, and a list of all other resonances elsewhere.
-        if (mean_motion_res[planet].numerator > res.numerator):
-          extra_mean_motion_res[planet].append(mean_motion_res[planet])
-          mean_motion_res[planet] = res
-        else:
-          extra_mean_motion_res[planet].append(res)
+        extra_mean_motion_res[planet].append(res)
       
-      print("resonance %i:%i between %s and %s : min(std) = %f" % (res.numerator, res.denominator, name[planet], name[planet+1], standard_deviation))
-    
-    if (delta_longitude.std() < STD_THRESHOLD):
-      longitude_res[planet] = True
+      print("resonance %i:%i between %s and %s : min(std) = %f" % (res[0], res[1], name[planet], name[planet+1], standard_deviation))
     
     #~ pdb.set_trace()
     
@@ -355,7 +310,7 @@ ylims = list(pl.ylim())
 xlims = list(pl.xlim())
 
 # We display the convergence zone
-if (vars().has_key('CZ')):
+if ('CZ' in vars()):
   if (type(CZ) == list):
     pl.plot(CZ[1], CZ[0], '-.', color="#000000")
   elif (type(CZ) in [float, int]):
@@ -368,7 +323,7 @@ for planet in range(0, nb_planets-1):
   # If there is resonance between the two planets, we display something
   if (mean_motion_res[planet] != None):
     # We construct the text for the main resonance
-    res = str(mean_motion_res[planet].numerator)+":"+str(mean_motion_res[planet].denominator)
+    res = "%i:%i" % mean_motion_res[planet]
     if (longitude_res[planet]):
       res += "*"
     
@@ -378,9 +333,9 @@ for planet in range(0, nb_planets-1):
   
   # We display, along the vertical line between the resonance and the text toward the main resonance value, the extra resonances if needed.
   if (len(extra_mean_motion_res[planet]) != 0):
-    extra_res = str(extra_mean_motion_res[planet][0].numerator)+":"+str(extra_mean_motion_res[planet][0].denominator)
+    extra_res = "%i:%i" % extra_mean_motion_res[planet][0]
     for res in extra_mean_motion_res[planet][1:]:
-      extra_res += " ; "+str(res.numerator)+":"+str(res.denominator)
+      extra_res += " ; %i:%i" % res
     pl.text(x_position, (ylims[1]+y_position)/2., extra_res, horizontalalignment='left', verticalalignment='center', rotation='vertical', size=7)
     
 #~ pl.ylim(-1, 1)
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 # Script that run a mercury simulation and test if the outputs and binaries have correct behaviour. 
 # The goal is to compare with a given version of the code, either an old one, the previous or current one.
+# Python 3.7 or newer is required.
 
 __author__ = "Christophe Cossou <cossou@obs.u-bordeaux1.fr>"
 __date__ = "3 august 2014"
@@ -11,8 +12,14 @@ import sys
 import os
 import difflib # To compare two strings
 import subprocess # To launch various process, get outputs et errors, returnCode and so on.
-import pdb # To debug
 import glob # to get list of file through a given pattern
+import shutil
+import tarfile
+import mmap
+import io
+import contextlib
+import concurrent.futures
+import multiprocessing
 from mercury import * # In order to create a simulation via python
 
 NEW_TEST = "example_simulation"
@@ -20,13 +27,45 @@ PREVIOUS_TEST = "old_simulation"
 REVISION = "HEAD"
 PROGRAM_NAME = "mercury"
 
-OUTPUT_FILENAMES = ["xv.out"]
-CLOSE_FILENAMES = ["ce.out"]
+ALGORITHMS = ["BS", "BS2", "MVS", "RADAU", "HYBRID"]
+NB_PROCESSES = min(len(ALGORITHMS), os.cpu_count() or 1) # Number of algorithms tested at the same time
+
+# list are sorted to ensure we compare the right files between actual and original outputs
+OUTPUT_FILENAMES = sorted(["xv.out"])
+CLOSE_FILENAMES = sorted(["ce.out"])
 ASCII_FILES = ["info.out", "big.dmp", "small.dmp", "param.dmp", "restart.dmp", "big.tmp", "small.tmp", "param.tmp", "restart.tmp"]
 
+BLOCK_SIZE = 1 << 16 # Size (in bytes) of the blocks read when comparing binary files
+MMAP_THRESHOLD = 4096 # Size (in bytes) above which ASCII files are mapped in memory to be read
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "mercury-compare") # Binaries of old revisions, in one sub-folder per commit ID
+
+# Bodies of the test simulation (the solar system).
+# Big bodies, in cartesian coordinates : (name, x, y, z, vx, vy, vz, m, r, d)
+BIG_BODIES = [
+  ("MERCURY", -3.83966017419175965E-01, -1.76865300855700736E-01, 2.07959213998758705E-02, 5.96286238644834141E-03, -2.43281292146216750E-02, -2.53463209848734695E-03, 1.66013679527193009E-07, 20.0e0, 5.43),
+  ("VENUS", 6.33469157915745540E-01, 3.49855234102151691E-01, -3.17853172088953667E-02, -9.84258038001823571E-03, 1.76183746921837227E-02, 8.08822351013463794E-04, 2.44783833966454430E-06, 20.0e0, 5.24),
+  ("EARTHMOO", 2.42093942183383037E-01, -9.87467766698604366E-01, -4.54276292555233496E-06, 1.64294055023289365E-02, 4.03200725816140870E-03, 1.13609607260006795E-08, 3.04043264264672381E-06, 20.0e0, 5.52),
+  ("MARS", 2.51831018120174499E-01, 1.52598983115984788E+00, 2.57781137811807781E-02, -1.32744166042475433E-02, 3.46582959610421387E-03, 3.98930013246952611E-04, 3.22715144505386530E-07, 20.0e0, 3.94),
+  ("JUPITER", 4.84143144246472090E+00, -1.16032004402742839E+00, -1.03622044471123109E-01, 1.66007664274403694E-03, 7.69901118419740425E-03, -6.90460016972063023E-05, 9.54791938424326609E-04, 3.0e0, 1.33),
+  ("SATURN", 8.34336671824457987E+00, 4.12479856412430479E+00, -4.03523417114321381E-01, -2.76742510726862411E-03, 4.99852801234917238E-03, 2.30417297573763929E-05, 2.85885980666130812E-04, 3.0e0, 0.70),
+  ("URANUS", 1.28943695621391310E+01, -1.51111514016986312E+01, -2.23307578892655734E-01, 2.96460137564761618E-03, 2.37847173959480950E-03, -2.96589568540237556E-05, 4.36624404335156298E-05, 3.0e0, 1.30),
+  ("NEPTUNE", 1.53796971148509165E+01, -2.59193146099879641E+01, 1.79258772950371181E-01, 2.68067772490389322E-03, 1.62824170038242295E-03, -9.51592254519715870E-05, 5.15138902046611451E-05, 3.0e0, 1.76),
+  ("PLUTO", -1.15095623952731607E+01, -2.70779438829451422E+01, 6.22871533567077229E+00, 2.97220056963797431E-03, -1.69820233395912967E-03, -6.76798264809371094E-04, 7.39644970414201173E-09, 3.0e0, 1.1),
+]
+# Small bodies, in orbital elements : (name, a, e, I, g, n, M, ep)
+SMALL_BODIES = [
+  ("APOLLO", 1.4710345, .5600245, 6.35621, 285.63908, 35.92313, 15.77656, 2450400.5),
+  ("JASON", 2.2157309, .7644575, 4.84834, 336.49610, 169.94137, 293.37226, 2450400.5),
+  ("KHUFU", 0.9894948, .4685310, 9.91298, 54.85927, 152.64772, 66.69818, 2450600.5),
+  ("MINOS", 1.1513383, .4127106, 3.93863, 239.50170, 344.85893, 8.93445, 2450400.5),
+  ("ORPHEUS", 1.2091305, .3226805, 2.68180, 301.55128, 189.79654, 28.31467, 2450400.5),
+  ("TOUTATIS", 2.5119660, .6335854, 0.46976, 274.82273, 128.20968, 50.00728, 2450600.5),
+]
+
 # Parameters
 force_source = False # To force the compilation of every module
 force_simulation = False # To force generation of simulation outputs for the "old" version of the code
+force_compilation = False # To compile the old revision even if its binary is in the cache (CACHE_FOLDER)
 
 isProblem = False
 problem_message = """Script that run a mercury simulation and test if the outputs and binaries have 
@@ -45,6 +84,8 @@ The script can take various arguments :
            simulation files from the example)
  * actual : To force copying HEAD simulation, compyling it, then generating 
             simulation outputs
+ * rebuild : To compile the old revision even if a binary compiled for the same
+             commit is available in %s
  * faq : Display possible problems that might occurs during comparison
  * rev=%s : (previous, actual, current) are possible. Else, every 
             Git ID syntax is OK. The reference revision for the 
@@ -60,7 +101,7 @@ The script can take various arguments :
                                 then generate outputs for for both binaries
 > compare_simulations.py rev=cdabb998 # compile the given revision, copy input 
                                       in old folder then generate outputs 
-                                      for both binaries""" % REVISION
+                                      for both binaries""" % (CACHE_FOLDER, REVISION)
 
 isFAQ = False
 faq_message = """* If you have differences, ensure that all 
@@ -89,9 +130,14 @@ for arg in sys.argv[1:]:
   elif (key == 'actual'):
     force_source = True
     force_simulation = True
+    force_compilation = True
     REVISION = "HEAD"
     if (value != None):
       print(value_message % (key, key, value))
+  elif (key == 'rebuild'):
+    force_compilation = True
+    if (value != None):
+      print(value_message % (key, key, value))
   elif (key == 'help'):
     isProblem = True
     if (value != None):
@@ -123,81 +169,79 @@ if isFAQ:
   exit()
 
 
-def run(commande):
-  """lance une commande qui sera typiquement soit une liste, soit une 
-  commande seule. La fonction renvoit un tuple avec la sortie, 
-  l'erreur et le code de retour"""
-  if (type(commande)==list):
-    process = subprocess.Popen(commande, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-  elif (type(commande)==str):
-    process = subprocess.Popen(commande, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-  else:
-    raise TypeError("The command is neither a string nor a list.")
-  (process_stdout, process_stderr) = process.communicate()
-  returncode = process.poll()
-  # there is .poll() or .wait() but I don't remember the difference. For some kind of things, one of the two was not working
-  return (process_stdout, process_stderr, returncode)
-
-def clean():
-  """Delete all outputs files for a given nautilus simulation"""
-  run("rm *.tmp")
-  run("rm *.dmp")
-  run("rm *.out")
+def run(commande, cwd=None, stderr=subprocess.PIPE):
+  """lance une commande, donnee sous forme de liste (le programme puis ses 
+  arguments), sans passer par un shell, dans le dossier 'cwd' (le dossier 
+  courant par defaut). La fonction renvoit un tuple avec la sortie, 
+  l'erreur et le code de retour. L'erreur vaut None si 'stderr' n'est pas 
+  subprocess.PIPE (subprocess.DEVNULL pour l'ignorer par exemple)"""
+  if (type(commande) != list):
+    raise TypeError("The command is not a list.")
+  process = subprocess.run(commande, stdout=subprocess.PIPE, stderr=stderr, cwd=cwd)
+  return (process.stdout, process.stderr, process.returncode)
+
+def clean(folder="."):
+  """Delete all outputs files for a given mercury simulation in the folder 'folder'"""
+  # One single pass over the folder for all the extensions
+  for entry in os.scandir(folder):
+    if (entry.name.endswith((".tmp", ".dmp", ".out")) and entry.is_file()):
+      os.remove(entry.path)
 
 def ASCIICompare(original, new):
-  """function that compare and print differences between to strings that are compared line by line."""
+  """function that compare and print differences between two lists of lines (without their ending '\\n').
+  The lines are bytes, as given by read_lines() or by the output of mercury, so that they do not need to be 
+  decoded. Only the differences found are decoded, to be printed."""
   
-  modified = ["+ ", "- ", "? "]
-  
-  # We want lists, because difflib.Differ only accept list of lines.
-  original = original.split("\n")
-  new = new.split("\n")
+  if (original == new):
+    return None
   
-  d = difflib.Differ()
-
-  result = list(d.compare(original, new))
+  # The opcodes directly give, for each block of differences, the range of lines in each list. 
+  matcher = difflib.SequenceMatcher(None, original, new, autojunk=False)
   
   differences = []
-  line_number_original = 0
-  line_number_new = 0
-  for line in result:
-    if (line[0:2] == "  "):
-      line_number_original += 1
-      line_number_new += 1
-    elif (line[0:2] == "- "):
-      line_number_original += 1
-      differences.append("[ori] l"+str(line_number_original)+" :"+line[2:])
-    elif (line[0:2] == "+ "):
-      line_number_new += 1
-      differences.append("[new] l"+str(line_number_new)+" :"+line[2:])
-    elif (line[0:2] == "? "):
-      differences.append("      l"+str(max(line_number_new, line_number_original))+" :"+line[2:])
+  for (tag, start_original, end_original, start_new, end_new) in matcher.get_opcodes():
+    if (tag in ["delete", "replace"]):
+      for line_number in range(start_original, end_original):
+        differences.append(b"[ori] l%d :%s" % (line_number+1, original[line_number]))
+    if (tag in ["insert", "replace"]):
+      for line_number in range(start_new, end_new):
+        differences.append(b"[new] l%d :%s" % (line_number+1, new[line_number]))
 
   # We print separately because it is more convenient if we want to store in a file instead.
   if (differences != []):
-    return "\n".join(differences)
+    return b"\n".join(differences).decode(errors="replace")
   else:
     return None
 
+def read_lines(filename):
+  """Return the list of the lines (bytes, without their ending '\\n') of the file 'filename'. 
+  The file is read at once in binary mode and is not decoded. 
+  Big files (more than MMAP_THRESHOLD bytes) are mapped in memory instead of being read."""
+  with open(filename, 'rb') as text_file:
+    if (os.fstat(text_file.fileno()).st_size < MMAP_THRESHOLD):
+      content = text_file.read()
+    else:
+      with mmap.mmap(text_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        content = mapped_file[:]
+  
+  return content.splitlines()
+
 def compare2files(ori_files,new_files):
   """Function that will use compare to see differences between 'original' 
   that is thought to be a variable and 'new_file' that is the name of a 
   file to read then use as input
+  Return the number of files with differences (0 if everything is OK)
   """
   no_diff = []
   diff = []
   
   for (original, new) in zip(ori_files, new_files):
-    f_old = open(original, 'r')
-    old_lines = f_old.readlines()
-    f_old.close()
-    
-    f_new = open(new, 'r')
-    new_lines = f_new.readlines()
-    f_new.close()
-    
+    # Identical files (the usual case) do not need to be read line by line and diffed
+    if files_equal(original, new):
+      no_diff.append(new)
+      continue
     
-    difference = ASCIICompare(''.join(old_lines), ''.join(new_lines))
+    difference = ASCIICompare(read_lines(original), read_lines(new))
     if (difference == None):
       no_diff.append(new)
     else:
@@ -210,28 +254,39 @@ def compare2files(ori_files,new_files):
       print(comp)
       
     if (no_diff != []):
-      print "No differences seen on :",', '.join(no_diff)
+      print("No differences seen on :", ', '.join(no_diff))
   else:
     print("Everything OK")  
   
-  return 0
+  return len(diff)
+
+def files_equal(original, new):
+  """Return True if the two files 'original' and 'new' have the same content. 
+  Files are compared block by block, and we stop at the first difference"""
+  # Files of different sizes are different, there is no need to read them
+  if (os.path.getsize(original) != os.path.getsize(new)):
+    return False
+  
+  with open(original, 'rb') as f_old, open(new, 'rb') as f_new:
+    while True:
+      block_old = f_old.read(BLOCK_SIZE)
+      block_new = f_new.read(BLOCK_SIZE)
+      if (block_old != block_new):
+        return False
+      if not(block_old):
+        return True
 
 def compare2Binaries(ori_files, new_files):
   """Function that will use compare to see differences between 'original' 
   that is thought to be a variable and 'new_file' that is the name of a 
   file to read then use as input
+  Return the number of files with differences (0 if everything is OK)
   """
   no_diff = []
   diff = []
   
   for (original, new) in zip(ori_files, new_files):
-    (stdout, stderr, returnCode) = run("md5sum %s" % original)
-    md5_ori = stdout.split()[0]
-    
-    (stdout, stderr, returnCode) = run("md5sum %s" % new)
-    md5_new = stdout.split()[0]
-    
-    if (md5_new != md5_ori):
+    if not(files_equal(original, new)):
       diff.append(original)
     else:
       no_diff.append(original)
@@ -246,79 +301,134 @@ def compare2Binaries(ori_files, new_files):
   else:
     print("Everything OK")
   
-  return 0
+  return len(diff)
 
-def initialising_input_objects(algorithm):
+def initialising_input_objects(folder):
   """Generation of base simulation.
   Create the objects, then generate the corresponding input files
-  in the current working directory.
+  in the folder 'folder'. Only 'param.in', that depend 
+  on the algorithm, is not generated (see write_param())
   """
-  mercury = BodyCart("big",name="MERCURY", x=-3.83966017419175965E-01, y=-1.76865300855700736E-01, z=2.07959213998758705E-02,
-  vx=5.96286238644834141E-03, vy=-2.43281292146216750E-02, vz=-2.53463209848734695E-03, m=1.66013679527193009E-07,
-  r=20.0e0, d=5.43)
-  venus = BodyCart("big",name="VENUS", x=6.33469157915745540E-01, y=3.49855234102151691E-01, z=-3.17853172088953667E-02,
-  vx=-9.84258038001823571E-03, vy=1.76183746921837227E-02, vz=8.08822351013463794E-04, m=2.44783833966454430E-06,
-  r=20.0e0, d=5.24)
-  earthmoo = BodyCart("big", name="EARTHMOO", x=2.42093942183383037E-01, y=-9.87467766698604366E-01, z=-4.54276292555233496E-06,
-  vx=1.64294055023289365E-02, vy=4.03200725816140870E-03, vz=1.13609607260006795E-08, m=3.04043264264672381E-06,
-  r=20.0e0, d=5.52)
-  mars = BodyCart("big", name="MARS", x=2.51831018120174499E-01, y=1.52598983115984788E+00, z=2.57781137811807781E-02,
-  vx=-1.32744166042475433E-02, vy=3.46582959610421387E-03, vz=3.98930013246952611E-04, m=3.22715144505386530E-07,
-  r=20.0e0, d=3.94)
-  jupiter = BodyCart("big", name="JUPITER", x=4.84143144246472090E+00, y=-1.16032004402742839E+00, z=-1.03622044471123109E-01,
-  vx=1.66007664274403694E-03, vy=7.69901118419740425E-03, vz=-6.90460016972063023E-05, m=9.54791938424326609E-04,
-  r=3.0e0, d=1.33)
-  saturn = BodyCart("big", name="SATURN", x=8.34336671824457987E+00, y=4.12479856412430479E+00, z=-4.03523417114321381E-01,
-  vx=-2.76742510726862411E-03, vy=4.99852801234917238E-03, vz=2.30417297573763929E-05, m=2.85885980666130812E-04,
-  r=3.0e0, d=0.70)
-  uranus = BodyCart("big", name="URANUS", x=1.28943695621391310E+01, y=-1.51111514016986312E+01, z=-2.23307578892655734E-01,
-  vx=2.96460137564761618E-03, vy=2.37847173959480950E-03, vz=-2.96589568540237556E-05, m=4.36624404335156298E-05,
-  r=3.0e0, d=1.30)
-  neptune = BodyCart("big", name="NEPTUNE", x=1.53796971148509165E+01, y=-2.59193146099879641E+01, z=1.79258772950371181E-01,
-  vx=2.68067772490389322E-03, vy=1.62824170038242295E-03, vz=-9.51592254519715870E-05, m=5.15138902046611451E-05,
-  r=3.0e0, d=1.76)
-  pluto = BodyCart("big", name="PLUTO", x=-1.15095623952731607E+01, y=-2.70779438829451422E+01, z=6.22871533567077229E+00,
-  vx=2.97220056963797431E-03, vy=-1.69820233395912967E-03, vz=-6.76798264809371094E-04, m=7.39644970414201173E-09,
-  r=3.0e0, d=1.1)
+  bodies = [BodyCart("big", name=name, x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, m=m, r=r, d=d) 
+            for (name, x, y, z, vx, vy, vz, m, r, d) in BIG_BODIES]
+  bodies += [BodyAst("small", name=name, a=a, e=e, I=I, g=g, n=n, M=M, ep=ep) 
+             for (name, a, e, I, g, n, M, ep) in SMALL_BODIES]
   
-  apollo = BodyAst("small", name="APOLLO", a=1.4710345, e=.5600245, I=6.35621, 
-  g=285.63908, n=35.92313, M=15.77656, ep=2450400.5)
-  jason = BodyAst("small", name="JASON", a=2.2157309, e=.7644575, I=4.84834, 
-  g=336.49610, n=169.94137, M=293.37226, ep=2450400.5)
-  khufu = BodyAst("small", name="KHUFU", a=0.9894948, e=.4685310, I=9.91298, 
-  g=54.85927, n=152.64772, M=66.69818, ep=2450600.5)
-  minos = BodyAst("small", name="MINOS", a=1.1513383, e=.4127106, I=3.93863, 
-  g=239.50170, n=344.85893, M=8.93445, ep=2450400.5)
-  orpheus = BodyAst("small", name="ORPHEUS", a=1.2091305, e=.3226805, I=2.68180, 
-  g=301.55128, n=189.79654, M=28.31467, ep=2450400.5)
-  toutatis = BodyAst("small", name="TOUTATIS", a=2.5119660, e=.6335854, I=0.46976, 
-  g=274.82273, n=128.20968, M=50.00728, ep=2450600.5)
-  
-  solarSystem = PlanetarySystem(bodies=[mercury, venus, earthmoo, mars, jupiter, saturn, uranus, 
-  neptune, pluto, apollo, jason, khufu, minos, orpheus, toutatis], m_star=1.0, epoch=2451000.5)
+  solarSystem = PlanetarySystem(bodies=bodies, m_star=1.0, epoch=2451000.5)
   
   bigin = Big(solarSystem)
-  bigin.write()
+  bigin.write(os.path.join(folder, "big.in"))
   
   smallin = Small(solarSystem)
-  smallin.write()
+  smallin.write(os.path.join(folder, "small.in"))
   
   elementin = Element(format_sortie=" a8.5 e8.6 i8.4 g8.4 n8.4 l8.4 m13e ", coord="Cen", 
   output_interval=365.2e1, time_format="years", relative_time="yes")
-  elementin.write()
+  elementin.write(os.path.join(folder, "element.in"))
   
   closein = Close(time_format="years", relative_time="yes")
-  closein.write()
+  closein.write(os.path.join(folder, "close.in"))
   
+  Files().write(os.path.join(folder, "files.in"))
+  Message().write(os.path.join(folder, "message.in"))
+
+def write_param(algorithm, filename):
+  """Generate the 'param.in' of the base simulation for the algorithm 'algorithm' 
+  in the file 'filename'. This is the only input file that change between algorithms.
+  """
   paramin = Param(algorithme=algorithm, start_time=2451179.5, stop_time=2462502.5, output_interval=365.25e0, 
   h=8, accuracy=1.e-12, stop_integration="no", collisions="no", fragmentation="no", 
   time_format="years", relative_time="no", output_precision="medium", relativity="no", 
   user_force="no", ejection_distance=100, radius_star=0.005, central_mass=1.0, 
   J2=0, J4=0, J6=0, changeover=3., data_dump=500, periodic_effect=100)
-  paramin.write()
+  paramin.write(filename)
+
+def link_or_copy(source, destination):
+  """Create 'destination' as a hard link to 'source' (no data is copied), 
+  or copy the file if a link is not possible (different filesystems for instance). 
+  Files that are written afterwards must not be linked, because the 
+  modifications would be seen in both places.
+  """
+  try:
+    os.link(source, destination)
+  except OSError:
+    shutil.copy2(source, destination)
+
+def run_algorithm(algo):
+  """Run the new and old binaries with the algorithm 'algo' and compare their outputs. 
+  The simulation is run in copies of the simulation folders (NEW_TEST_algo 
+  and PREVIOUS_TEST_algo) so that several algorithms can be run at the same time. 
+  They are deleted once the comparison is done, unless differences or errors were found. 
+  Return the report of the comparison as a string, errors included.
+  """
+  new_folder = "%s_%s" % (NEW_TEST, algo)
+  old_folder = "%s_%s" % (PREVIOUS_TEST, algo)
+  
+  # We create names including the folder in which they are, once for all the comparisons
+  OUTPUT_FILENAMES_OLD = [os.path.join(old_folder, filename) for filename in OUTPUT_FILENAMES]
+  OUTPUT_FILENAMES_NEW = [os.path.join(new_folder, filename) for filename in OUTPUT_FILENAMES]
+  CLOSE_FILENAMES_OLD = [os.path.join(old_folder, filename) for filename in CLOSE_FILENAMES]
+  CLOSE_FILENAMES_NEW = [os.path.join(new_folder, filename) for filename in CLOSE_FILENAMES]
+  ASCII_OLD = [os.path.join(old_folder, filename) for filename in ASCII_FILES]
+  ASCII_NEW = [os.path.join(new_folder, filename) for filename in ASCII_FILES]
+  
+  # The copies are kept if the comparison fails or finds differences, to be able to look at them
+  isIdentical = False
+  
+  report = io.StringIO()
+  with contextlib.redirect_stdout(report):
+    try:
+      print("##########################################")
+      
+      # The example simulation already contains the inputs common to all the algorithms. 
+      # They are linked in each folder, and we only write 'param.in' in it.
+      for folder in [new_folder, old_folder]:
+        if os.path.isdir(folder):
+          shutil.rmtree(folder)
+        shutil.copytree(NEW_TEST, folder, copy_function=link_or_copy, ignore=shutil.ignore_patterns("param.in"))
+        write_param(algo, os.path.join(folder, "param.in"))
+      
+      # Only the standard output of mercury is compared, its errors are not read
+      (merc_new__stdout, merc_new__stderr, returnCode) = run([os.path.join("..", PROGRAM_NAME)], cwd=new_folder, stderr=subprocess.DEVNULL)
+      
+      print("Running new binaries with %s ...ok" % algo)
+      
+      # We run the old version simulation
+      print("##########################################")
+      (merc_or_stdout, merc_or_stderr, returnCode) = run([os.path.join("..", PREVIOUS_TEST, PROGRAM_NAME)], cwd=old_folder, stderr=subprocess.DEVNULL)
+      print("Running old binaries with %s ...ok" % algo)
+      print("##########################################")
+      
+      # We make the comparison
+      
+      diff = ASCIICompare(merc_or_stdout.splitlines(), merc_new__stdout.splitlines())
+      if (diff != None):
+        print("\nTest of mercury")
+        print("\tFor the Output of mercury")
+        print(diff)
+      
+      print("comparing outputs:")
+      nb_diff = compare2Binaries(OUTPUT_FILENAMES_OLD, OUTPUT_FILENAMES_NEW)
+      
+      print("comparing close encounters:")
+      nb_diff += compare2Binaries(CLOSE_FILENAMES_OLD, CLOSE_FILENAMES_NEW)
+      
+      print("comparing ASCII files (info.out,...)")
+      nb_diff += compare2files(ASCII_OLD, ASCII_NEW)
+      print("##########################################")
+      
+      isIdentical = ((diff == None) and (nb_diff == 0))
+    except OSError as error:
+      # A missing binary or output file only stops the comparison for this algorithm
+      print("\nComparison aborted for %s : %s" % (algo, error))
+    finally:
+      if isIdentical:
+        for folder in [new_folder, old_folder]:
+          shutil.rmtree(folder, ignore_errors=True)
+      else:
+        print("The simulations are kept in %s and %s" % (new_folder, old_folder))
   
-  Files().write()
-  Message().write()
+  return report.getvalue()
 
 ##################
 # Outputs of various binaries and tests to compare with the actual ones. 
@@ -326,10 +436,8 @@ def initialising_input_objects(algorithm):
 ##################
 
 
-os.chdir(NEW_TEST)
 # We clean undesirable files beforehand, because we will copy if necessary the input simulation files to the other folder. 
-clean()
-os.chdir("..")
+clean(NEW_TEST)
 
 # We create folder and force old simulation generation if this is the first time we run the script
 if not(os.path.isdir(PREVIOUS_TEST)):
@@ -340,108 +448,82 @@ if not(os.path.isdir(PREVIOUS_TEST)):
 # We delete old files, get the desired revision of the code, and the corresponding simulation files, compile it and so on.
 if force_source:
   print("Preparing old binaries ...")
-  run("rm %s/*" % PREVIOUS_TEST) # Delete all files in the test directory
+  # We retrieve the commit ID from the possible alias stored in 'REVISION'
+  (REVISION_ID, dummy, returnCode) = run(["git", "rev-parse", REVISION])
+  (HEAD_ID, dummy, returnCode_head) = run(["git", "rev-parse", "HEAD"])
+  REVISION_ID = REVISION_ID.decode().strip()
+  HEAD_ID = HEAD_ID.decode().strip()
   
-  # Copy the given revision REVISION in the required sub-folder (PREVIOUS_TEST)
-  ## REVISION can either be a given commit, or HEAD, or READ^ and so on. Any commit ID available in Git.
-  #> @Warning Problems for comparison can occurs if output files changes format between the two revisions.
-  ## This script is intended to compare recent version of the code, when outputs changes are not expected. When outputs changes,
-  ## one must be carefull with implementation and do the test themselves.
-  get_revision = "git archive %s --format=tar --prefix=%s/ | tar xf -" % (REVISION, PREVIOUS_TEST)
+  # We stop before deleting anything if the revision does not exist
+  if (returnCode != 0):
+    print("The revision '%s' can't be found by git, the old binaries are left unchanged" % REVISION)
+    exit()
   
-  print(get_revision)
-  run(get_revision)
+  # Binaries already compiled for a given commit are kept in a cache folder named after its ID
+  cache_folder = os.path.join(CACHE_FOLDER, REVISION_ID)
+  cached_binary = os.path.join(cache_folder, PROGRAM_NAME)
+  isCached = (os.path.isfile(cached_binary) and not(force_compilation))
   
-  # We retrieve the commit ID from the possible alias stored in 'REVISION'
-  (REVISION_ID, dummy, returnCode) = run("git rev-parse %s" % REVISION)
-  (HEAD_ID, dummy, returnCode) = run("git rev-parse HEAD")
+  # Delete all files in the test directory
+  for filename in glob.glob(os.path.join(PREVIOUS_TEST, "*")):
+    if os.path.isfile(filename):
+      os.remove(filename)
   
-  os.chdir(PREVIOUS_TEST)
+  if isCached:
+    print("Using the binary compiled for %s in %s" % (REVISION_ID, cache_folder))
+    shutil.copy2(cached_binary, PREVIOUS_TEST)
+  else:
+    # Copy the given revision REVISION in the required sub-folder (PREVIOUS_TEST)
+    ## REVISION can either be a given commit, or HEAD, or READ^ and so on. Any commit ID available in Git.
+    #> @Warning Problems for comparison can occurs if output files changes format between the two revisions.
+    ## This script is intended to compare recent version of the code, when outputs changes are not expected. When outputs changes,
+    ## one must be carefull with implementation and do the test themselves.
+    git_archive = ["git", "archive", REVISION, "--format=tar", "--prefix=%s/" % PREVIOUS_TEST]
+    
+    # The archive is extracted while it is streamed, without any 'tar' process
+    print(" ".join(git_archive))
+    archive = subprocess.Popen(git_archive, stdout=subprocess.PIPE)
+    isExtracted = True
+    try:
+      with tarfile.open(fileobj=archive.stdout, mode="r|") as archive_file:
+        # This is our own repository, we trust it. Versions of python without extraction filters always behave this way.
+        if hasattr(tarfile, 'fully_trusted_filter'):
+          archive_file.extractall(filter='fully_trusted')
+        else:
+          archive_file.extractall()
+    except tarfile.ReadError as error:
+      print("Unable to read the archive of %s : %s" % (REVISION, error))
+      isExtracted = False
+    archive.stdout.close()
+    
+    if ((archive.wait() != 0) or not(isExtracted)):
+      print("The sources of %s can't be extracted, the old binaries can't be compiled" % REVISION)
+      exit()
+    
+    # Compilation of previous code
+    previous_compilation = ["Makefile.py", "test"]
+    print(" ".join(previous_compilation))
+    (stdout, stderr, returnCode_compilation) = run(previous_compilation, cwd=PREVIOUS_TEST)
+    
+    if (returnCode_compilation != 0):
+      print(stdout.decode())
+      print(stderr.decode())
+    else:
+      os.makedirs(cache_folder, exist_ok=True)
+      shutil.copy2(os.path.join(PREVIOUS_TEST, PROGRAM_NAME), cache_folder)
   
   # We store information about old commit used for comparison, in the corresponding folder.
-  revision_file = open("revision.in", 'w')
+  revision_file = open(os.path.join(PREVIOUS_TEST, "revision.in"), 'w')
   revision_file.write("Old revision: %s\n" % REVISION)
   revision_file.write("Old revision ID: %s\n" % REVISION_ID)
   revision_file.write("Current revision ID (HEAD): %s\n(but uncommitted changes might exists)\n" % HEAD_ID)
   revision_file.close()
-  
-  # Compilation of previous code
-  previous_compilation = "Makefile.py test"
-  print(previous_compilation)
-  (stdout, stderr, returnCode) = run(previous_compilation)
-  
-  if (returnCode != 0):
-    print(stdout)
-    print(stderr)
-  
-  os.chdir("..")
-
-for algo in ["BS", "BS2", "MVS", "RADAU", "HYBRID"]:
-		
-	print("##########################################")
-	sys.stdout.write("Running new binaries with %s ...\r" % algo)
-	sys.stdout.flush()
-	os.chdir(NEW_TEST)
-
-	clean() # Suppress previous temporary files
-
-	initialising_input_objects(algorithm=algo)
-
-	(merc_new__stdout, merc_new__stderr, returnCode) = run("../%s" % PROGRAM_NAME)
-
-	# list are sorted to ensure we compare the right files between actual and original outputs
-	OUTPUT_FILENAMES.sort()
-	CLOSE_FILENAMES.sort()
-
-	os.chdir("..")
-	print("Running new binaries with %s ...ok" % algo)
-
-	# We run the old version simulation
-	print("##########################################")
-	os.chdir(PREVIOUS_TEST)
-	# Copy of simulation files
-	copy_files = "cp ../%s/* ." % NEW_TEST
-	print(copy_files)
-	run(copy_files)
-
-	clean() # Suppress previous temporary files
-	sys.stdout.write("Running old binaries with %s ...\r" % algo)
-	sys.stdout.flush()
-	(merc_or_stdout, merc_or_stderr, returnCode) = run("./%s" % PROGRAM_NAME)
-	print("Running old binaries with %s ...ok" % algo)
-	print("##########################################")
-
-	# Go back in parent directory (containing the current code and test script)
-	os.chdir("..")
-
-	# We make the comparison
-
-	diff = ASCIICompare(merc_or_stdout, merc_new__stdout)
-	if (diff != None):
-	  print("\nTest of mercury")
-	  print("\tFor the Output of mercury")
-	  print diff
-
-	# We create names including the folder in which they are
-	CLOSE_FILENAMES_NEW = [os.path.join(NEW_TEST, filename) for filename in CLOSE_FILENAMES]
-	OUTPUT_FILENAMES_NEW = [os.path.join(NEW_TEST, filename) for filename in OUTPUT_FILENAMES]
-
-	# We create names including the folder in which they are
-	CLOSE_FILENAMES_OLD = [os.path.join(PREVIOUS_TEST, filename) for filename in CLOSE_FILENAMES]
-	OUTPUT_FILENAMES_OLD = [os.path.join(PREVIOUS_TEST, filename) for filename in OUTPUT_FILENAMES]
-
-	print("comparing outputs:")
-	compare2Binaries(OUTPUT_FILENAMES_OLD, OUTPUT_FILENAMES_NEW)
-
-	print("comparing close encounters:")
-	compare2Binaries(CLOSE_FILENAMES_OLD, CLOSE_FILENAMES_NEW)
-
 
-	# We include the folder name because we are in the parent folder.
-	ASCII_OLD = [os.path.join(PREVIOUS_TEST, filename) for filename in ASCII_FILES]
-	ASCII_NEW = [os.path.join(NEW_TEST, filename) for filename in ASCII_FILES]
+# The input files that do not depend on the algorithm are generated once, in the example simulation
+initialising_input_objects(NEW_TEST)
 
-	#~ pdb.set_trace()
-	print("comparing ASCII files (info.out,...)")
-	compare2files(ASCII_OLD, ASCII_NEW)
-	print("##########################################")
+# Each algorithm is tested in its own copies of the simulation folders, so they are all run in parallel. 
+# Reports are displayed in the order of the algorithms.
+with concurrent.futures.ProcessPoolExecutor(max_workers=NB_PROCESSES, mp_context=multiprocessing.get_context('fork')) as executor:
+  for report in executor.map(run_algorithm, ALGORITHMS):
+    print(report, end='')
@@ -14,7 +14,6 @@ __credits__ = """Thanks to Bastien for his help when I was learning Python and h
 import sys
 import os
 import time
-import commands
 import subprocess
 import math
 import pdb
@@ -268,11 +267,12 @@ def enumeration(liste):
 def lancer_commande(commande):
   """lance une commande qui sera typiquement soit une liste, soit une 
   commande seule. La fonction renvoit un tuple avec la sortie, 
-  l'erreur et le code de retour"""
+  l'erreur et le code de retour. La sortie et l'erreur sont du texte 
+  (str) aussi bien en python 2 qu'en python 3"""
   if (type(commande)==list):
-    process = subprocess.Popen(commande, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = subprocess.Popen(commande, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
   elif (type(commande)==str):
-    process = subprocess.Popen(commande, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    process = subprocess.Popen(commande, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, universal_newlines=True)
   else:
     raise TypeError("The command is neither a string nor a list.")
   (process_stdout, process_stderr) = process.communicate()
@@ -597,7 +597,7 @@ def colorList(nb_colors, exclude=['ffffff']):
   iteration = 0
   # We search for all individual values (for R, G, B) that we need to define at least the number of colors we want.
   while (len(colors) < individual_colors):
-    step = 255 / (2**(iteration + 1))
+    step = 255 // (2**(iteration + 1))
     
     iteration += 1
 
@@ -605,7 +605,7 @@ def colorList(nb_colors, exclude=['ffffff']):
     nb_el = 2**iteration
 
     # We start at half the step
-    temp = step/2
+    temp = step // 2
     for i in range(nb_el):
       colors.append(temp)
       temp += step
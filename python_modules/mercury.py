@@ -557,13 +557,16 @@ class Big(object):
       
     
     
-  def write(self):
-    """write all the data in a file named 'big.in' in the current working directory"""
+  def write(self, filename="big.in"):
+    """write all the data in a file named 'big.in' in the current working directory
+    
+    Parameter
+    filename="big.in" : the name (or path) of the file to write"""
     
     #########################
     #on crée le fichier et We write the header
     #########################
-    bigin = open('big.in','w')
+    bigin = open(filename,'w')
 
     #on recopie l'entête du fichier type
     bigin.write(Big.BIG_START)
@@ -677,13 +680,16 @@ class Small(object):
     
     self.system = system
     
-  def write(self):
-    """write all the data in a file named 'big.in' in the current working directory"""
+  def write(self, filename="small.in"):
+    """write all the data in a file named 'small.in' in the current working directory
+    
+    Parameter
+    filename="small.in" : the name (or path) of the file to write"""
     
     #########################
     #on crée le fichier et We write the header
     #########################
-    smallin = open('small.in','w')
+    smallin = open(filename,'w')
 
     #on recopie l'entête du fichier type
     smallin.write(Small.SMALL_START)
@@ -820,11 +826,14 @@ class Element(object):
     # if perculiar planets only are used, you must add some lines here to get the 
     # last lines of the parameters array that are not currently stored
   
-  def write(self):
-    """write all the data in a file named 'element.in' in the current working directory"""
+  def write(self, filename="element.in"):
+    """write all the data in a file named 'element.in' in the current working directory
+    
+    Parameter
+    filename="element.in" : the name (or path) of the file to write"""
     
     ## We generate the file "element.in" with values passed in parameter.s.
-    element = open('element.in','w')
+    element = open(filename,'w')
     ## We write the header
     element.write(Element.ELEMENT_START)
     ## On écrit dans quel système de coordonnées on veut écrire les données
@@ -1118,11 +1127,14 @@ class Close(object):
     self.relative_time = relative_time
   
   
-  def write(self):
-    """write all the data in a file named 'element.in' in the current working directory"""
+  def write(self, filename="close.in"):
+    """write all the data in a file named 'close.in' in the current working directory
     
-    ## We generate the file "element.in" with values passed in parameter.s.
-    close = open('close.in','w')
+    Parameter
+    filename="close.in" : the name (or path) of the file to write"""
+    
+    ## We generate the file "close.in" with values passed in parameter.s.
+    close = open(filename,'w')
     ## We write the header
     close.write(Close.CLOSE_START)
     ## Dans quel format on veut écrire les temps (jours ou années)
@@ -1341,10 +1353,10 @@ class Message(object):
     
     #Nothing to initialize for the moment
   
-  def write(self):
-    """Create the file 'message.in'"""
+  def write(self, filename="message.in"):
+    """Create the file 'message.in' (or 'filename')"""
     
-    fichier = open("message.in", "w")
+    fichier = open(filename, "w")
     fichier.write(Message.FILE)
     fichier.close()
 
@@ -1368,9 +1380,9 @@ class Files(object):
     
     # Nothing to initialize for the moment
   
-  def write(self):
-    """Create the file 'files.in'"""
-    fichier = open("files.in", "w")
+  def write(self, filename="files.in"):
+    """Create the file 'files.in' (or 'filename')"""
+    fichier = open(filename, "w")
     fichier.write(Files.FILE)
     fichier.close()
 
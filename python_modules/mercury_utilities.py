@@ -15,6 +15,8 @@ import subprocess
 import pdb
 import os
 
+NB_SUBMISSIONS = 4 # Number of simulations submitted at the same time by submitBatch()
+
 #~ # Dictionnary that store, for each server, the location of the binaries for mercury (in this folder, there are mercury, element and close
 #~ BINARY_FOLDER = {'arguin.obs.u-bordeaux1.fr':"/home/cossou/bin/mercury", 
                  #~ 'avakas-frontend2':"/home/ccossou/bin/mercury",
@@ -128,9 +130,13 @@ def get_aei_files():
   liste_aei.remove('') # we remove an extra element that doesn't mean anything
   return liste_aei
 
-def mercury_restart():
+def mercury_restart(submit=True):
   """function that will restart a simulation. That means cleaning the existing file, 
   and launch the simulation again, from the start
+  
+  Parameters :
+  submit=True : if False, the simulation is only cleaned, and must be submitted 
+                later (for instance with submitBatch())
   """
   
   # For each folder were there is a problem (NaN in the output in other words) we clean and relaunch the simulation
@@ -138,24 +144,69 @@ def mercury_restart():
   print("\tCleaning the simulation files : %s" % command)
   (stdout, stderr, returnCode) = autiwa.lancer_commande(command)
   
+  if not(submit):
+    return
+  
   command = "./runjob"
   print("\tContinuing the simulation to allow it to finish properly : %s" % command)
   job = subprocess.Popen(command, shell=True)
   returnCode = job.wait()
 
-def mercury_continue():
+def mercury_continue(submit=True):
   """function that will continue an existing simulation that did not have time to finish
+  
+  Parameters :
+  submit=True : if False, the simulation is only cleaned, and must be submitted 
+                later (for instance with submitBatch())
   """
   command = "rm *.aei *.clo"
   print("\tCleaning the simulation files : %s" % command)
   (stdout, stderr, returnCode) = autiwa.lancer_commande(command)
-
+  
+  if not(submit):
+    return
+  
   command = "./runjob"
   print("\tStarting the simulation again : %s" % command)
   job = subprocess.Popen(command, shell=True)
   returnCode = job.wait()
+
+def runjob(folder):
+  """Run the 'runjob' script of the simulation stored in 'folder' (absolute path), 
+  i.e submit it to the queue scheduler. Return the return code of the script, 
+  or -1 if it can't be run at all"""
+  try:
+    return subprocess.call(["./runjob"], cwd=folder)
+  except OSError:
+    return -1
+
+def submitBatch(folders):
+  """function that will submit the simulations of all the given folders. Each folder must 
+  contain a 'runjob' script (see prepareSubmission()). The scripts are run without shell, 
+  NB_SUBMISSIONS at the same time, since each one mostly waits for the queue scheduler.
   
+  Parameters :
+  folders : list of the absolute paths of the simulations to submit
+  
+  Return :
+  The list of the folders whose submission failed
+  """
+  if (folders == []):
+    return []
   
+  # Imported here so that the rest of the module can still be used with python 2
+  import concurrent.futures
+  
+  print("Submitting %d simulations" % len(folders))
+  with concurrent.futures.ThreadPoolExecutor(max_workers=NB_SUBMISSIONS) as executor:
+    returnCodes = list(executor.map(runjob, folders))
+  
+  failed = [folder for (folder, returnCode) in zip(folders, returnCodes) if (returnCode != 0)]
+  for folder in failed:
+    print("\tThe submission of %s failed" % folder)
+  
+  return failed
+
 def generateElementIN(nb_outputs=2000):
   """Will create a element.in with a low number of outputs then generate them"""
   
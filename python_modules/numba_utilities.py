@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""module that give access to the 'njit' decorator of numba, numba being optional. 
+It is only imported by the scripts that compile some functions, because importing 
+numba takes time.
+
+HOW TO USE : 
+import numba_utilities
+@numba_utilities.njit(cache=True)
+def function(...):
+"""
+from __future__ import print_function
+
+try:
+  from numba import njit
+  NUMBA_AVAILABLE = True
+except ImportError:
+  NUMBA_AVAILABLE = False
+  
+  def njit(*args, **kwargs):
+    """Without numba, the decorated functions are simply run by the python interpreter. 
+    Work both as @njit and @njit(...)"""
+    if ((len(args) == 1) and callable(args[0]) and (kwargs == {})):
+      return args[0]
+    return lambda function: function
@@ -16,7 +16,9 @@ from math import *
 import autiwa
 import pdb
 import subprocess
+import sys
 import os # at least to have access to the os.path.isfile() method.
+import contextlib
 
 def setExecutionRight(doc_name):
   """function that set the right for the file to be executed. This file must be in the current working directory
@@ -639,6 +641,39 @@ def getHostname():
   
   return hostname
 
+def list_folders(path):
+  """Return the sorted list of the names of the sub-folders of 'path'. 
+  os.scandir give the type of each entry along with its name, so we 
+  do not need an extra stat for each entry"""
+  with os.scandir(path) as entries:
+    folders = [entry.name for entry in entries if entry.is_dir()]
+  folders.sort()
+  
+  return folders
+
+def parse_arguments(parser):
+  """Return the arguments of the script, parsed with the argparse.ArgumentParser 'parser'. 
+  The historical syntax 'key' or 'key=value' is translated into '--key' or '--key=value' 
+  beforehand, so that both syntaxes can be used"""
+  return parser.parse_args([arg if arg.startswith("-") else "--" + arg for arg in sys.argv[1:]])
+
+@contextlib.contextmanager
+def working_directory(path):
+  """Context manager that execute the enclosed block in the folder 'path', 
+  then go back to the previous working directory, even if an error occurs. 
+  To be used with functions that only work in the current working directory
+  
+  Example : 
+  with working_directory("simu0001"):
+    mercury_utilities.mercury_continue()
+  """
+  previous_path = os.getcwd()
+  os.chdir(path)
+  try:
+    yield
+  finally:
+    os.chdir(previous_path)
+
 if __name__=='__main__':
   autiwa.printCR("Test of str2bool...")
   tests_outputs = ""